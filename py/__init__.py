@@ -1,3 +1,6 @@
 from .simulation import *
 from .utils import *
+from .pileup import *
 from .acme import *
+from .superread_store import *
+from .superread_state import *
@@ -1,12 +1,16 @@
 import json
+import os
+import sys
+import time
 
-from sklearn.manifold import SpectralEmbedding
 import numpy as np
-from Bio import SeqIO
-import scipy
-import pandas as pd
-import matplotlib.pyplot as plt
-import pysam
+
+from .pileup import pileup_counts, parallel_pileup_counts, read_batches
+from .vacs import covarying_lookup, batch_reference_ends, batch_vacs
+from .superread_store import vacs_matrix, load_superreads, write_superreads
+from .superread_store import load_superread_columns, column_vacs
+from .instrumentation import stage, profiled, peak_rss_megabytes
+from .pileup_cache import cached_pileup_counts
 
 
 characters = ['A', 'C', 'G', 'T', '-']
@@ -45,52 +49,84 @@ def single_read_count_data(read):
     return sequence, positions
 
 
-def all_read_count_data(alignment):
-    reference_length = alignment.header['SQ'][0]['LN']
-    counts = np.zeros((reference_length, 5))
-    for read in alignment.fetch():
-        sequence, positions = single_read_count_data(read)
-        for character_index, character in enumerate(characters):
-            rows = positions[sequence == character]
-            counts[rows, character_index] += 1
-    return counts
-
-
+def all_read_count_data(
+        alignment, batch_size=20000, processes=1, window_size=1000, cache=True
+        ):
+    def compute_counts():
+        if processes > 1:
+            return parallel_pileup_counts(
+                alignment.filename.decode(), processes, window_size, batch_size
+            )
+        reference_length = alignment.header['SQ'][0]['LN']
+        return pileup_counts(alignment.fetch(), reference_length, batch_size)
 
-def supplementary_info(row):
-    result = row.loc[['A', 'C', 'G', 'T']] \
-        .sort_values(ascending=False)
-    result.index = ['c1', 'c2', 'c3', 'c4']
-    return result.append(pd.Series(
-        result.values/row['coverage'] if row['coverage'] else 0,
-        index=['f1', 'f2', 'f3', 'f4']
-    ))
+    if cache:
+        counts = cached_pileup_counts(
+            alignment.filename.decode(), compute_counts
+        )
+    else:
+        counts = compute_counts()
+    return counts.astype(np.float64)
 
 
-def zeros(df, character):
-    return (df[character] == 0).astype(np.int)
 
+def count_table(counts):
+    import pandas as pd
 
-def site_table(alignment):
-    counts = all_read_count_data(alignment)
     df = pd.DataFrame(counts, columns=characters)
-    col_0s = zeros(df, 'A') + zeros(df, 'C') + zeros(df, 'G') + zeros(df, 'T')
-    df['interesting'] = col_0s < 3
-    df['nucleotide_max'] = df[['A', 'C', 'G', 'T']].max(axis=1)
-    df['coverage'] = df[['A', 'C', 'G', 'T']].sum(axis=1)
-    df['consensus'] = '-'
-    for character in characters[:-1]:
-        consensus_agreement = df['nucleotide_max'] == df[character]
-        df.loc[consensus_agreement, 'consensus'] = character
-    return pd.concat([df, df.apply(supplementary_info, axis=1)], axis=1)
+    nucleotide_counts = np.asarray(counts)[:, :4]
+    # Sorting the bases in reverse order lets ties resolve to the last base.
+    reversed_counts = nucleotide_counts[:, ::-1]
+    order = np.argsort(-reversed_counts, axis=1, kind='stable')
+    sorted_counts = np.take_along_axis(reversed_counts, order, axis=1)
+    coverage = nucleotide_counts.sum(axis=1)
+    frequencies = np.divide(
+        sorted_counts, coverage[:, np.newaxis],
+        out=np.zeros(sorted_counts.shape), where=coverage[:, np.newaxis] > 0
+    )
+    df['interesting'] = sorted_counts[:, 1] > 0
+    df['nucleotide_max'] = sorted_counts[:, 0]
+    df['coverage'] = coverage
+    df['consensus'] = np.array(characters[:-1])[3 - order[:, 0]]
+    for i in range(4):
+        df['c%d' % (i+1)] = sorted_counts[:, i]
+    for i in range(4):
+        df['f%d' % (i+1)] = frequencies[:, i]
+    return df
+
+
+def site_table(alignment, processes=1, window_size=1000, cache=True):
+    with stage('pileup') as counts:
+        read_counts = all_read_count_data(
+            alignment, processes=processes, window_size=window_size,
+            cache=cache
+        )
+        if alignment.has_index():
+            counts['reads'] = alignment.mapped
+    with stage('site_table') as counts:
+        table = count_table(read_counts)
+        counts['sites'] = len(table)
+    return table
 
 
 def extract_label(query_name):
     return '-'.join(query_name.split('.')[:4]) if not '+' in query_name else 'AR'
 
 
-def get_covarying_sites(alignment, threshold=.01, end_correction=10):
-    nucleotide_counts = site_table(alignment)
+def get_covarying_sites(
+        alignment, threshold=.01, end_correction=10, processes=1,
+        window_size=1000, cache=True
+        ):
+    nucleotide_counts = site_table(alignment, processes, window_size, cache)
+    with stage('thresholding') as counts:
+        covarying_sites = threshold_sites(
+            nucleotide_counts, threshold, end_correction
+        )
+        counts['covarying_sites'] = len(covarying_sites)
+    return covarying_sites
+
+
+def threshold_sites(nucleotide_counts, threshold=.01, end_correction=10):
     above_threshold = (
         nucleotide_counts
         .loc[:, ['f1', 'f2', 'f3', 'f4']] > threshold
@@ -105,21 +141,36 @@ def get_covarying_sites(alignment, threshold=.01, end_correction=10):
     return covarying_sites[desired]
 
 
-def read_reference_start_and_end(alignment, site_boundaries):
-    read_information = pd.DataFrame(
-        [
-            (read.reference_start, read.reference_end)
-            for read in alignment.fetch()
-        ],
-        columns=['reference_start', 'reference_end']
-    )
-    read_information['covarying_start'] = np.searchsorted(
-        site_boundaries, read_information['reference_start']
-    )
-    read_information['covarying_end'] = np.searchsorted(
-        site_boundaries, read_information['reference_end']
-    )
-    return read_information
+def threshold_sweep(nucleotide_counts, thresholds, end_correction=10):
+    # Frequencies are sorted per site, so a site has two bases above a
+    # threshold exactly when its second highest frequency is. Sorting sites
+    # by that frequency once turns every threshold into a single cut.
+    second_frequencies = nucleotide_counts['f2'].to_numpy(dtype=np.float64)
+    number_of_sites = len(second_frequencies)
+    sites = np.arange(end_correction + 1, number_of_sites - end_correction)
+    second_frequencies = second_frequencies[sites]
+    second_frequencies[np.isnan(second_frequencies)] = -np.inf
+    order = np.argsort(second_frequencies, kind='stable')
+    sorted_frequencies = second_frequencies[order]
+    return {
+        threshold: np.sort(sites[order[
+            np.searchsorted(sorted_frequencies, threshold, side='right'):
+        ]])
+        for threshold in thresholds
+    }
+
+
+def covarying_site_sweep(
+        alignment, thresholds, end_correction=10, processes=1,
+        window_size=1000, cache=True
+        ):
+    nucleotide_counts = site_table(alignment, processes, window_size, cache)
+    with stage('thresholding') as counts:
+        covarying_sites = threshold_sweep(
+            nucleotide_counts, thresholds, end_correction
+        )
+        counts['thresholds'] = len(thresholds)
+    return covarying_sites
 
 
 def admission(minimum_weight):
@@ -128,48 +179,77 @@ def admission(minimum_weight):
     return comparator
 
 
-def obtain_superreads(alignment, covarying_sites, minimum_weight=3):
-    read_information = read_reference_start_and_end(
-        alignment, covarying_sites
+def fold_read(superreads, value_at_covarying_sites, query_name):
+    label = extract_label(query_name)
+    has_ar = 1 if '+' in query_name else 0
+    if value_at_covarying_sites in superreads:
+        superreads[value_at_covarying_sites][0] += 1
+        superreads[value_at_covarying_sites][1] += has_ar
+        if not label in superreads[value_at_covarying_sites][2]:
+            superreads[value_at_covarying_sites][2][label] = 0
+        superreads[value_at_covarying_sites][2][label] += 1
+    else:
+        superreads[value_at_covarying_sites] = [1, has_ar, {label: 1}]
+
+
+def group_superreads(alignment, covarying_sites, batch_size=20000):
+    reference_length = alignment.header['SQ'][0]['LN']
+    return fold_reads(
+        {}, alignment.fetch(), covarying_sites, reference_length, batch_size
     )
-    read_groups = {}
-    all_reads = list(alignment.fetch())
-    for i, read in enumerate(all_reads):
-        row = read_information.iloc[i, :]
-        key = (row['covarying_start'], row['covarying_end'])
-        if key in read_groups:
-            read_groups[key].append(i)
-        else:
-            read_groups[key] = [i]
+
+
+def fold_reads(
+        read_groups, reads, covarying_sites, reference_length, batch_size=20000
+        ):
+    lookup = covarying_lookup(covarying_sites, reference_length)
+    batches = read_batches(reads, batch_size, query_names=True)
+    while True:
+        with stage('fetch') as counts:
+            batch = next(batches, None)
+            if batch is not None:
+                counts['reads'] = len(batch['reference_starts'])
+        if batch is None:
+            break
+        with stage('vacs'):
+            covarying_starts = np.searchsorted(
+                covarying_sites, batch['reference_starts']
+            )
+            covarying_ends = np.searchsorted(
+                covarying_sites, batch_reference_ends(batch)
+            )
+            all_vacs = batch_vacs(batch, lookup)
+        with stage('grouping') as counts:
+            counts['grouped_reads'] = np.count_nonzero(
+                covarying_starts != covarying_ends
+            )
+            for query_name, covarying_start, covarying_end, value_at_covarying_sites \
+                    in zip(
+                        batch['query_names'], covarying_starts.tolist(),
+                        covarying_ends.tolist(), all_vacs
+                    ):
+                if covarying_start == covarying_end:
+                    continue
+                covarying_boundaries = (covarying_start, covarying_end)
+                if not covarying_boundaries in read_groups:
+                    read_groups[covarying_boundaries] = {}
+                fold_read(
+                    read_groups[covarying_boundaries], value_at_covarying_sites,
+                    query_name
+                )
+    return read_groups
+
+
+def superreads_from_groups(read_groups, minimum_weight=3):
+    # Groups, VACS and labels are taken in sorted order rather than the
+    # order reads were seen in, so that indices do not depend on how reads
+    # were folded in and incremental updates match a full recompute.
     all_superreads = []
     superread_index = 0
-    for covarying_boundaries, read_group in read_groups.items():
-        if covarying_boundaries[0] == covarying_boundaries[1]:
-            continue
-        superreads = {}
-        for read_index in read_group:
-            read = all_reads[read_index]
-            label = extract_label(read.query_name)
-            covarying_sites_in_read = covarying_sites[
-                covarying_boundaries[0]: covarying_boundaries[1]
-            ]
-            value_at_covarying_sites = ''.join(
-                [
-                    read.query[triplet[0]].upper()
-                    for triplet in read.get_aligned_pairs(True)
-                    if triplet[1] in covarying_sites_in_read
-                ]
-            )
-            has_ar = 1 if '+' in read.query_name else 0
-            if value_at_covarying_sites in superreads:
-                superreads[value_at_covarying_sites][0] += 1
-                superreads[value_at_covarying_sites][1] += has_ar
-                if not label in superreads[value_at_covarying_sites][2]:
-                     superreads[value_at_covarying_sites][2][label] = 0
-                superreads[value_at_covarying_sites][2][label] += 1
-            else:
-                superreads[value_at_covarying_sites] = [1, has_ar, {label: 1}]
-        admissible_superreads = list(filter(admission(minimum_weight), superreads.items()))
+    for covarying_boundaries, superreads in sorted(read_groups.items()):
+        admissible_superreads = list(filter(
+            admission(minimum_weight), sorted(superreads.items())
+        ))
         total_weight = sum([
             superread[1][0] for superread in admissible_superreads
         ])
@@ -183,13 +263,35 @@ def obtain_superreads(alignment, covarying_sites, minimum_weight=3):
                 'ar_frequency': weight[1]/weight[0],
                 'cv_start': int(covarying_boundaries[0]),
                 'cv_end': int(covarying_boundaries[1]),
-                'composition': weight[2],
+                'composition': dict(sorted(weight[2].items())),
                 'discarded': False
             })
             superread_index += 1
     return all_superreads
 
 
+def obtain_superreads(alignment, covarying_sites, minimum_weight=3):
+    read_groups = group_superreads(alignment, covarying_sites)
+    with stage('superreads') as counts:
+        superreads = superreads_from_groups(read_groups, minimum_weight)
+        counts['read_groups'] = len(read_groups)
+        counts['distinct_superreads'] = len(superreads)
+    return superreads
+
+
+def superread_sweep(alignment, covarying_sites, minimum_weights):
+    # Admission only filters grouped counts, so one grouping pass serves
+    # every minimum weight.
+    read_groups = group_superreads(alignment, covarying_sites)
+    with stage('superreads') as counts:
+        superreads = {
+            minimum_weight: superreads_from_groups(read_groups, minimum_weight)
+            for minimum_weight in minimum_weights
+        }
+        counts['read_groups'] = len(read_groups)
+    return superreads
+
+
 def superread_cv_filter(superreads, min_cv_start, max_cv_end):
     def cv_filter(sr):
         starts_after = sr['cv_start'] >= min_cv_start
@@ -198,104 +300,250 @@ def superread_cv_filter(superreads, min_cv_start, max_cv_end):
     return list(filter(cv_filter, superreads))
 
 
+def overlap_candidates(cv_starts, cv_ends, order, sorted_starts, first, last):
+    # Sweep over superreads sorted by cv_start: the partners of superread i
+    # start in [i's cv_start, i's cv_end) and end no earlier than i does.
+    lower = np.searchsorted(sorted_starts, cv_starts[first: last], 'left')
+    upper = np.searchsorted(sorted_starts, cv_ends[first: last], 'left')
+    number_of_candidates = np.maximum(upper - lower, 0)
+    rows = np.repeat(np.arange(first, last), number_of_candidates)
+    candidate_starts = np.cumsum(number_of_candidates) - number_of_candidates
+    offsets = np.arange(number_of_candidates.sum()) \
+        - np.repeat(candidate_starts, number_of_candidates)
+    columns = order[np.repeat(lower, number_of_candidates) + offsets]
+    ends_after = cv_ends[columns] >= cv_ends[rows]
+    return rows[ends_after], columns[ends_after]
+
+
+def pair_agreement(matrix, lengths, cv_starts, cv_ends, rows, columns):
+    delta = cv_ends[rows] - cv_starts[columns]
+    row_offsets = cv_starts[columns] - cv_starts[rows]
+    compared = np.minimum(
+        np.clip(lengths[rows] - row_offsets, 0, delta),
+        np.clip(lengths[columns], 0, delta)
+    )
+    pair_index = np.repeat(np.arange(len(rows)), compared)
+    position = np.arange(compared.sum()) \
+        - np.repeat(np.cumsum(compared) - compared, compared)
+    agrees = matrix[rows[pair_index], row_offsets[pair_index] + position] \
+        == matrix[columns[pair_index], position]
+    return np.bincount(
+        pair_index, weights=agrees, minlength=len(rows)
+    ).astype(np.int64)
+
+
 def get_score_matrix(superreads, min_cv_start, max_cv_end,
-        minimum_agreement=0, power=1):
+        minimum_agreement=0, power=1, batch_size=1000):
+    import scipy.sparse
+
     n_sr = len(superreads)
-    scores = []
-    rows = []
-    cols = []
-    for i, superread_i in enumerate(superreads):
-        for j, superread_j in enumerate(superreads):
-            i_cv_start = superread_i['cv_start']
-            i_cv_end = superread_i['cv_end']
-            j_cv_start = superread_j['cv_start']
-            j_cv_end = superread_j['cv_end']
-            start_before_start = i_cv_start <= j_cv_start
-            start_before_end = j_cv_start < i_cv_end
-            end_before_end = i_cv_end <= j_cv_end
-            if start_before_start and start_before_end and end_before_end:
-                cv_start = max(i_cv_start, j_cv_start)
-                cv_end = min(i_cv_end, j_cv_end)
-                delta = cv_end - cv_start
-                i_start = cv_start - i_cv_start
-                i_end = i_start + delta
-                j_start = cv_start - j_cv_start
-                j_end = j_start + delta
-                i_sequence = np.array(superread_i['vacs'][i_start: i_end], dtype='<U1')
-                j_sequence = np.array(superread_j['vacs'][j_start: j_end], dtype='<U1')
-                agreement = (i_sequence == j_sequence).sum()
-                if agreement > minimum_agreement:
-                    rows.append(i)
-                    cols.append(j)
-                    weight = min(superread_i['weight'], superread_j['weight'])
-                    scores.append(agreement**power * weight)
-    return scipy.sparse.csr_matrix((scores, (rows, cols)), shape=(n_sr, n_sr))
-
-
-def perform_spectral_embedding(superreads, min_cv_start, max_cv_end):
-    X = get_score_matrix(superreads, min_cv_start, max_cv_end)
-    return SpectralEmbedding(
-        n_components=2,
-        random_state=0,
-        affinity='precomputed'
-    ).fit_transform(X.todense())
+    matrix, lengths = vacs_matrix(superreads)
+    cv_starts = np.array([sr['cv_start'] for sr in superreads], dtype=np.int64)
+    cv_ends = np.array([sr['cv_end'] for sr in superreads], dtype=np.int64)
+    weights = np.array([sr['weight'] for sr in superreads], dtype=np.int64)
+    order = np.argsort(cv_starts, kind='stable')
+    sorted_starts = cv_starts[order]
+    all_columns = []
+    all_scores = []
+    row_counts = np.zeros(n_sr, dtype=np.int64)
+    for first in range(0, n_sr, batch_size):
+        last = min(first + batch_size, n_sr)
+        rows, columns = overlap_candidates(
+            cv_starts, cv_ends, order, sorted_starts, first, last
+        )
+        agreement = pair_agreement(
+            matrix, lengths, cv_starts, cv_ends, rows, columns
+        )
+        desired = agreement > minimum_agreement
+        rows = rows[desired]
+        columns = columns[desired]
+        by_column = np.lexsort((columns, rows))
+        rows = rows[by_column]
+        columns = columns[by_column]
+        agreement = agreement[desired][by_column]
+        row_counts += np.bincount(rows, minlength=n_sr)
+        all_columns.append(columns)
+        all_scores.append(
+            agreement**power * np.minimum(weights[rows], weights[columns])
+        )
+    indptr = np.concatenate([[0], np.cumsum(row_counts)])
+    return scipy.sparse.csr_matrix(
+        (
+            np.concatenate(all_scores) if n_sr > 0 else np.zeros(0),
+            np.concatenate(all_columns) if n_sr > 0 else np.zeros(0, dtype=np.int64),
+            indptr
+        ),
+        shape=(n_sr, n_sr)
+    )
 
 
-def get_labels(superreads):
-    return [max(sr['composition'].items(), key=lambda x: x[1])[0] for sr in superreads]
+def symmetrized_affinity(score_matrix):
+    score_matrix = score_matrix.astype(np.float64)
+    return ((score_matrix + score_matrix.T) / 2).tocsr()
+
+
+def perform_spectral_embedding(
+        superreads, min_cv_start, max_cv_end, n_components=2, eigen_tol=0.0,
+        eigen_solver='arpack', statistics=None
+        ):
+    from sklearn.manifold import spectral_embedding
+
+    with stage('score_matrix') as counts:
+        X = get_score_matrix(superreads, min_cv_start, max_cv_end)
+        counts['superreads'] = X.shape[0]
+        counts['nonzero_edges'] = X.nnz
+    with stage('affinity'):
+        affinity = symmetrized_affinity(X)
+    with stage('embedding'):
+        start = time.perf_counter()
+        embedding = spectral_embedding(
+            affinity,
+            n_components=n_components,
+            eigen_solver=eigen_solver,
+            eigen_tol=eigen_tol,
+            random_state=0
+        )
+        if statistics is not None:
+            statistics['solve_seconds'] = time.perf_counter() - start
+    return embedding
 
 
-def sc_covarying_sites_io(bam_path, json_path):
-    alignment = pysam.AlignmentFile(bam_path, 'rb')
-    covarying_sites = get_covarying_sites(alignment)
-    covarying_sites_json = [int(site) for site in covarying_sites]
-    with open(json_path, 'w') as json_file:
-        json.dump(covarying_sites_json, json_file)
+def get_labels(superreads):
+    # The most common label, ties going to the first label alphabetically.
+    return [
+        min(sr['composition'].items(), key=lambda x: (-x[1], x[0]))[0]
+        for sr in superreads
+    ]
+
+
+def sc_covarying_sites_io(
+        bam_path, json_path, processes=1, window_size=1000, instrument=None
+        ):
+    import pysam
+
+    with profiled('sc_covarying_sites_io', json_path, instrument):
+        alignment = pysam.AlignmentFile(bam_path, 'rb')
+        covarying_sites = get_covarying_sites(
+            alignment, processes=int(processes), window_size=int(window_size)
+        )
+        covarying_sites_json = [int(site) for site in covarying_sites]
+        with open(json_path, 'w') as json_file:
+            json.dump(covarying_sites_json, json_file)
+
 
+def parameter_path(path, **parameters):
+    # Parameters are appended in the Snakefile's wildcard style, e.g.
+    # superreads.json becomes superreads_th-0.01_mw-3.json.
+    stem, extension = os.path.splitext(path)
+    suffix = ''.join(
+        '_%s-%s' % (name, value) for name, value in parameters.items()
+    )
+    return stem + suffix + extension
 
-def sc_superread_io(bam_path, covarying_path, superread_path):
-    with open(covarying_path) as json_file:
-        covarying_sites = np.array(json.load(json_file), dtype=np.int)
-    alignment = pysam.AlignmentFile(bam_path, 'rb')
 
-    superreads = obtain_superreads(alignment, covarying_sites)
-    with open(superread_path, 'w') as json_file:
-        json.dump(superreads, json_file, indent=2)
+def sc_parameter_sweep_io(
+        bam_path, covarying_path, superread_path, thresholds=(.01,),
+        minimum_weights=(3,), end_correction=10, processes=1,
+        window_size=1000, instrument=None
+        ):
+    import pysam
 
+    with profiled('sc_parameter_sweep_io', superread_path, instrument):
+        alignment = pysam.AlignmentFile(bam_path, 'rb')
+        covarying_sites = covarying_site_sweep(
+            alignment, [float(threshold) for threshold in thresholds],
+            int(end_correction), int(processes), int(window_size)
+        )
+        outputs = []
+        previous_sites = None
+        for threshold, sites in covarying_sites.items():
+            covarying_output = parameter_path(covarying_path, th=threshold)
+            with open(covarying_output, 'w') as json_file:
+                json.dump([int(site) for site in sites], json_file)
+            # Neighbouring thresholds often select the same sites.
+            if previous_sites is None or not np.array_equal(sites, previous_sites):
+                swept_superreads = superread_sweep(
+                    alignment, sites,
+                    [int(minimum_weight) for minimum_weight in minimum_weights]
+                )
+                previous_sites = sites
+            for minimum_weight, superreads in swept_superreads.items():
+                superread_output = parameter_path(
+                    superread_path, th=threshold, mw=minimum_weight
+                )
+                with stage('write') as counts:
+                    write_superreads(superreads, superread_output)
+                    counts['superreads'] = len(superreads)
+                outputs.append({
+                    'threshold': threshold,
+                    'minimum_weight': minimum_weight,
+                    'covarying_sites': covarying_output,
+                    'superreads': superread_output
+                })
+    return outputs
+
+
+def sc_superread_io(bam_path, covarying_path, superread_path, instrument=None):
+    import pysam
+
+    with profiled('sc_superread_io', superread_path, instrument):
+        with open(covarying_path) as json_file:
+            covarying_sites = np.array(json.load(json_file), dtype=np.int)
+        alignment = pysam.AlignmentFile(bam_path, 'rb')
+
+        superreads = obtain_superreads(alignment, covarying_sites)
+        with stage('write') as counts:
+            write_superreads(superreads, superread_path)
+            counts['superreads'] = len(superreads)
+
+
+def sc_embedding_io(
+        superread_path, embedding_path, min_cv_start, max_cv_end,
+        eigen_tol=0.0, instrument=None
+        ):
+    import pandas as pd
 
-def sc_embedding_io(superread_path, embedding_path, min_cv_start, max_cv_end):
     min_cv_start = int(min_cv_start)
     max_cv_end = int(max_cv_end)
-    with open(superread_path) as json_file:
-        superreads = superread_cv_filter(
-            json.load(json_file),
-            min_cv_start,
-            max_cv_end
+    with profiled('sc_embedding_io', embedding_path, instrument):
+        with stage('load') as counts:
+            superreads = load_superreads(superread_path, min_cv_start, max_cv_end)
+            counts['superreads'] = len(superreads)
+        statistics = {}
+        embedding = perform_spectral_embedding(
+            superreads, min_cv_start, max_cv_end, eigen_tol=float(eigen_tol),
+            statistics=statistics
+        )
+        sys.stderr.write(
+            'Embedded %d superreads: eigensolve %.2f seconds, peak RSS %.1f MB\n'
+            % (len(superreads), statistics['solve_seconds'], peak_rss_megabytes())
         )
-    embedding = perform_spectral_embedding(superreads, min_cv_start, max_cv_end)
-    df = pd.DataFrame({
-        'x': embedding[:, 0],
-        'y': embedding[:, 1],
-        'label': get_labels(superreads)
-    })
-    df.to_csv(embedding_path)
+        df = pd.DataFrame({
+            'x': embedding[:, 0],
+            'y': embedding[:, 1],
+            'label': get_labels(superreads)
+        })
+        df.to_csv(embedding_path)
 
 
 def sc_srfasta_io(input_cvs, input_srdata, output_fasta):
     with open(input_cvs) as json_file:
         cvs = json.load(json_file)
-    with open(input_srdata) as json_file:
-        srdata = json.load(json_file)
+    srdata = load_superread_columns(input_srdata)
     outfile = open(output_fasta, 'w')
     n_cvs = len(cvs)
-    for sr in srdata:
-        outfile.write('>superread-%d\n' % sr['index'])
-        seq = sr['cv_start']*'-' + sr['vacs'] + (n_cvs - sr['cv_end'])*'-'
+    for i in range(srdata['number_of_superreads']):
+        cv_start = int(srdata['cv_start'][i])
+        cv_end = int(srdata['cv_end'][i])
+        outfile.write('>superread-%d\n' % srdata['index'][i])
+        seq = cv_start*'-' + column_vacs(srdata, i) + (n_cvs - cv_end)*'-'
         outfile.write(seq + '\n')
     outfile.close()
 
 
 def sc_truthcvs_io():
+    from Bio import SeqIO
+
     truth = list(SeqIO.parse(input_fasta))
     for record in truth:
         record.seq = ''.join([record.seq[i] for i in cvs])
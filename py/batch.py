@@ -0,0 +1,135 @@
+import argparse
+import importlib
+import itertools
+import json
+import sys
+import time
+import traceback
+from multiprocessing import Pool
+
+
+def stage_function(stage):
+    # Either a function exported by the py package or a module:function spec.
+    if ':' in stage:
+        module_name, function_name = stage.split(':', 1)
+    else:
+        module_name, function_name = __package__, stage
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError as error:
+        raise ValueError(
+            'Unknown stage %s: cannot import %s (%s)' % (stage, module_name, error)
+        )
+    function = getattr(module, function_name, None)
+    if not callable(function):
+        raise ValueError(
+            'Unknown stage %s: %s has no function %s' %
+            (stage, module_name, function_name)
+        )
+    return function
+
+
+def expand_targets(patterns, **wildcards):
+    # Mirrors Snakemake's expand: every combination of wildcard values fills
+    # in each string argument, and other arguments are passed unchanged.
+    names = list(wildcards)
+    targets = []
+    for values in itertools.product(*[wildcards[name] for name in names]):
+        fields = dict(zip(names, values))
+        targets.append({
+            argument: pattern.format(**fields) if isinstance(pattern, str)
+            else pattern
+            for argument, pattern in patterns.items()
+        })
+    return targets
+
+
+def run_target(arguments):
+    stage, index, target = arguments
+    start = time.perf_counter()
+    result = {'index': index}
+    try:
+        function = stage_function(stage)
+        if isinstance(target, dict):
+            function(**target)
+        else:
+            function(*target)
+    except Exception:
+        result['error'] = traceback.format_exc()
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def run_batch(stage, targets, processes=1):
+    # Workers live for the whole batch, so imports, codec tables and parsed
+    # references are paid for once per worker rather than once per target.
+    stage_function(stage)
+    arguments = [(stage, index, target) for index, target in enumerate(targets)]
+    start = time.perf_counter()
+    if processes > 1:
+        with Pool(processes) as pool:
+            results = list(pool.imap_unordered(run_target, arguments))
+    else:
+        results = [run_target(argument) for argument in arguments]
+    seconds = time.perf_counter() - start
+    results.sort(key=lambda result: result['index'])
+    failed = [result for result in results if 'error' in result]
+    return {
+        'stage': stage,
+        'targets': len(targets),
+        'failed': len(failed),
+        'processes': processes,
+        'seconds': seconds,
+        'targets_per_second': len(targets) / seconds if seconds > 0 else 0,
+        'target_seconds': sum(result['seconds'] for result in results),
+        'results': results
+    }
+
+
+def run_manifest(manifest_path, processes=1):
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+    if 'targets' in manifest:
+        targets = manifest['targets']
+    else:
+        targets = expand_targets(manifest['patterns'], **manifest['wildcards'])
+    return run_batch(manifest['stage'], targets, processes)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run one py stage for every target of a manifest in a single process.'
+    )
+    parser.add_argument(
+        'manifest',
+        help='JSON with a stage, either a py function or module:function, '
+        'and either its targets, as keyword dicts or argument lists, or '
+        'patterns and wildcards to expand into targets'
+    )
+    parser.add_argument(
+        '-p', '--processes', type=int, default=1, help='worker processes'
+    )
+    parser.add_argument('-o', '--output', help='optional JSON report')
+    args = parser.parse_args()
+
+    report = run_manifest(args.manifest, args.processes)
+    for result in report['results']:
+        if 'error' in result:
+            sys.stderr.write(
+                'Target %d failed:\n%s' % (result['index'], result['error'])
+            )
+    if args.output:
+        with open(args.output, 'w') as json_file:
+            json.dump(report, json_file, indent=2)
+    print(
+        '%s: %d targets, %d failed, %.2f seconds, %.2f targets per second' % (
+            report['stage'], report['targets'], report['failed'],
+            report['seconds'], report['targets_per_second']
+        )
+    )
+    if report['failed'] > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
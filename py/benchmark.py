@@ -0,0 +1,891 @@
+import argparse
+import importlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+import pysam
+import scipy.sparse
+from Bio import SeqIO
+
+from .acme import characters, single_read_count_data, all_read_count_data
+from .acme import count_table, get_score_matrix, get_covarying_sites
+from .acme import obtain_superreads, perform_spectral_embedding
+from .pileup import read_batches
+from .vacs import covarying_lookup, batch_vacs
+from .codec import fasta_matrix
+from .distance import hamming_distances
+from .utils import water_aligned_sequences, local_aligned_sequences
+from .utils import pairwise_distance_csv
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def per_read_count_data(alignment):
+    reference_length = alignment.header['SQ'][0]['LN']
+    counts = np.zeros((reference_length, 5))
+    for read in alignment.fetch():
+        sequence, positions = single_read_count_data(read)
+        for character_index, character in enumerate(characters):
+            rows = positions[sequence == character]
+            counts[rows, character_index] += 1
+    return counts
+
+
+def pileup_benchmark(bam_path):
+    alignment = pysam.AlignmentFile(bam_path, 'rb')
+    number_of_reads = alignment.mapped
+    per_read_counts, per_read_seconds = timed(per_read_count_data, alignment)
+    batched_counts, batched_seconds = timed(
+        all_read_count_data, alignment, cache=False
+    )
+    alignment.close()
+    return {
+        'reads': number_of_reads,
+        'per_read_seconds': per_read_seconds,
+        'per_read_reads_per_second': number_of_reads / per_read_seconds,
+        'batched_seconds': batched_seconds,
+        'batched_reads_per_second': number_of_reads / batched_seconds,
+        'speedup': per_read_seconds / batched_seconds,
+        'identical_counts': bool(np.array_equal(per_read_counts, batched_counts))
+    }
+
+
+def supplementary_info(row):
+    result = row.loc[['A', 'C', 'G', 'T']] \
+        .sort_values(ascending=False)
+    result.index = ['c1', 'c2', 'c3', 'c4']
+    return pd.concat([result, pd.Series(
+        result.values/row['coverage'] if row['coverage'] else 0,
+        index=['f1', 'f2', 'f3', 'f4']
+    )])
+
+
+def zeros(df, character):
+    return (df[character] == 0).astype(int)
+
+
+def per_row_count_table(counts):
+    df = pd.DataFrame(counts, columns=characters)
+    col_0s = zeros(df, 'A') + zeros(df, 'C') + zeros(df, 'G') + zeros(df, 'T')
+    df['interesting'] = col_0s < 3
+    df['nucleotide_max'] = df[['A', 'C', 'G', 'T']].max(axis=1)
+    df['coverage'] = df[['A', 'C', 'G', 'T']].sum(axis=1)
+    df['consensus'] = '-'
+    for character in characters[:-1]:
+        consensus_agreement = df['nucleotide_max'] == df[character]
+        df.loc[consensus_agreement, 'consensus'] = character
+    return pd.concat([df, df.apply(supplementary_info, axis=1)], axis=1)
+
+
+def synthetic_counts(reference_length, depth=1000, error_rate=.005, seed=1):
+    np.random.seed(seed)
+    frequencies = np.full((reference_length, 5), error_rate)
+    frequencies[np.arange(reference_length), np.random.randint(4, size=reference_length)] = 1
+    variable = np.random.rand(reference_length) < .05
+    frequencies[variable, np.random.randint(4, size=variable.sum())] += .3
+    frequencies /= frequencies.sum(axis=1)[:, np.newaxis]
+    return np.vstack([
+        np.random.multinomial(depth, row) for row in frequencies
+    ]).astype(np.float64)
+
+
+def site_table_benchmark(reference_length=10000, depth=1000):
+    counts = synthetic_counts(reference_length, depth)
+    per_row_table, per_row_seconds = timed(per_row_count_table, counts)
+    columnar_table, columnar_seconds = timed(count_table, counts)
+    return {
+        'reference_length': reference_length,
+        'per_row_seconds': per_row_seconds,
+        'columnar_seconds': columnar_seconds,
+        'speedup': per_row_seconds / columnar_seconds,
+        'identical_tables': bool(per_row_table.equals(columnar_table))
+    }
+
+
+def read_vacs(read, covarying_sites_in_read):
+    return ''.join(
+        [
+            read.query[triplet[0]].upper()
+            for triplet in read.get_aligned_pairs(True)
+            if triplet[1] in covarying_sites_in_read
+        ]
+    )
+
+
+def per_read_vacs(reads, covarying_sites):
+    all_vacs = []
+    for read in reads:
+        covarying_start = np.searchsorted(covarying_sites, read.reference_start)
+        covarying_end = np.searchsorted(covarying_sites, read.reference_end)
+        all_vacs.append(read_vacs(
+            read, covarying_sites[covarying_start: covarying_end]
+        ))
+    return all_vacs
+
+
+def batched_vacs(reads, covarying_sites, reference_length):
+    lookup = covarying_lookup(covarying_sites, reference_length)
+    all_vacs = []
+    for batch in read_batches(reads):
+        all_vacs.extend(batch_vacs(batch, lookup))
+    return all_vacs
+
+
+def vacs_benchmark(
+        bam_path, site_counts=(10, 50, 100, 500, 1000), number_of_reads=2000
+        ):
+    alignment = pysam.AlignmentFile(bam_path, 'rb')
+    reference_length = alignment.header['SQ'][0]['LN']
+    reads = list(islice(alignment.fetch(), number_of_reads))
+    alignment.close()
+    results = []
+    for site_count in site_counts:
+        covarying_sites = np.unique(np.linspace(
+            0, reference_length - 1, min(site_count, reference_length)
+        ).astype(np.int64))
+        per_read, per_read_seconds = timed(per_read_vacs, reads, covarying_sites)
+        batched, batched_seconds = timed(
+            batched_vacs, reads, covarying_sites, reference_length
+        )
+        results.append({
+            'covarying_sites': len(covarying_sites),
+            'per_read_microseconds': 1e6 * per_read_seconds / len(reads),
+            'batched_microseconds': 1e6 * batched_seconds / len(reads),
+            'identical_vacs': per_read == batched
+        })
+    return results
+
+
+def baseline_score_matrix(superreads, min_cv_start, max_cv_end,
+        minimum_agreement=0, power=1):
+    # The original get_score_matrix, verbatim, as the timing baseline. Its
+    # '<U1' arrays keep only the first character of each slice, so its
+    # agreements are 0 or 1 and its matrix differs from the sweep's.
+    n_sr = len(superreads)
+    scores = []
+    rows = []
+    cols = []
+    for i, superread_i in enumerate(superreads):
+        for j, superread_j in enumerate(superreads):
+            i_cv_start = superread_i['cv_start']
+            i_cv_end = superread_i['cv_end']
+            j_cv_start = superread_j['cv_start']
+            j_cv_end = superread_j['cv_end']
+            start_before_start = i_cv_start <= j_cv_start
+            start_before_end = j_cv_start < i_cv_end
+            end_before_end = i_cv_end <= j_cv_end
+            if start_before_start and start_before_end and end_before_end:
+                cv_start = max(i_cv_start, j_cv_start)
+                cv_end = min(i_cv_end, j_cv_end)
+                delta = cv_end - cv_start
+                i_start = cv_start - i_cv_start
+                i_end = i_start + delta
+                j_start = cv_start - j_cv_start
+                j_end = j_start + delta
+                i_sequence = np.array(superread_i['vacs'][i_start: i_end], dtype='<U1')
+                j_sequence = np.array(superread_j['vacs'][j_start: j_end], dtype='<U1')
+                agreement = (i_sequence == j_sequence).sum()
+                if agreement > minimum_agreement:
+                    rows.append(i)
+                    cols.append(j)
+                    weight = min(superread_i['weight'], superread_j['weight'])
+                    scores.append(agreement**power * weight)
+    return scipy.sparse.csr_matrix((scores, (rows, cols)), shape=(n_sr, n_sr))
+
+
+def corrected_score_matrix(superreads, minimum_agreement=0, power=1):
+    # The baseline loop modified to compare every character of the overlap,
+    # as a per-pair reference for the sweep's matrix.
+    n_sr = len(superreads)
+    scores = []
+    rows = []
+    cols = []
+    for i, superread_i in enumerate(superreads):
+        for j, superread_j in enumerate(superreads):
+            i_cv_start = superread_i['cv_start']
+            i_cv_end = superread_i['cv_end']
+            j_cv_start = superread_j['cv_start']
+            j_cv_end = superread_j['cv_end']
+            start_before_start = i_cv_start <= j_cv_start
+            start_before_end = j_cv_start < i_cv_end
+            end_before_end = i_cv_end <= j_cv_end
+            if start_before_start and start_before_end and end_before_end:
+                cv_start = max(i_cv_start, j_cv_start)
+                cv_end = min(i_cv_end, j_cv_end)
+                delta = cv_end - cv_start
+                i_start = cv_start - i_cv_start
+                i_end = i_start + delta
+                j_start = cv_start - j_cv_start
+                j_end = j_start + delta
+                i_sequence = np.array(list(superread_i['vacs'][i_start: i_end]), dtype='<U1')
+                j_sequence = np.array(list(superread_j['vacs'][j_start: j_end]), dtype='<U1')
+                compared = min(len(i_sequence), len(j_sequence))
+                agreement = (i_sequence[:compared] == j_sequence[:compared]).sum()
+                if agreement > minimum_agreement:
+                    rows.append(i)
+                    cols.append(j)
+                    weight = min(superread_i['weight'], superread_j['weight'])
+                    scores.append(agreement**power * weight)
+    return scipy.sparse.csr_matrix((scores, (rows, cols)), shape=(n_sr, n_sr))
+
+
+def synthetic_superreads(
+        number_of_superreads, superreads_per_site=20, minimum_length=5,
+        maximum_length=30, number_of_haplotypes=5, error_rate=.01, seed=1
+        ):
+    np.random.seed(seed)
+    number_of_sites = max(
+        number_of_superreads // superreads_per_site, maximum_length + 1
+    )
+    haplotypes = np.random.choice(
+        list('ACGT'), (number_of_haplotypes, number_of_sites)
+    )
+    lengths = np.random.randint(
+        minimum_length, maximum_length, number_of_superreads
+    )
+    cv_starts = np.random.randint(0, number_of_sites - lengths)
+    superreads = []
+    for index in range(number_of_superreads):
+        cv_start = int(cv_starts[index])
+        cv_end = cv_start + int(lengths[index])
+        vacs = haplotypes[np.random.randint(number_of_haplotypes), cv_start: cv_end].copy()
+        errors = np.random.rand(len(vacs)) < error_rate
+        vacs[errors] = np.random.choice(list('ACGT'), errors.sum())
+        superreads.append({
+            'index': index,
+            'vacs': ''.join(vacs),
+            'weight': int(np.random.randint(3, 100)),
+            'cv_start': cv_start,
+            'cv_end': cv_end
+        })
+    return superreads
+
+
+def score_matrix_benchmark(
+        sizes=(1000, 3000, 10000, 30000, 100000), per_pair_limit=2000
+        ):
+    results = []
+    for size in sizes:
+        superreads = synthetic_superreads(size)
+        matrix, seconds = timed(get_score_matrix, superreads, 0, 0)
+        result = {
+            'superreads': size,
+            'nonzero_edges': int(matrix.nnz),
+            'sweep_seconds': seconds
+        }
+        if size <= per_pair_limit:
+            _, baseline_seconds = timed(
+                baseline_score_matrix, superreads, 0, 0
+            )
+            result['baseline_seconds'] = baseline_seconds
+            result['speedup'] = baseline_seconds / seconds
+            corrected_matrix, corrected_seconds = timed(
+                corrected_score_matrix, superreads
+            )
+            result['corrected_per_pair_seconds'] = corrected_seconds
+            result['identical_to_corrected_per_pair'] = \
+                (corrected_matrix != matrix).nnz == 0
+        results.append(result)
+    return results
+
+
+def traced(function, *args, **kwargs):
+    tracemalloc.start()
+    result, seconds = timed(function, *args, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def unicode_fasta_matrix(fasta_path):
+    records = list(SeqIO.parse(fasta_path, 'fasta'))
+    return [record.id for record in records], np.array(
+        [list(str(record.seq)) for record in records],
+        dtype='<U1'
+    )
+
+
+def fasta_load_benchmark(fasta_path):
+    (unicode_headers, unicode_matrix), unicode_seconds, unicode_peak = traced(
+        unicode_fasta_matrix, fasta_path
+    )
+    (headers, matrix), codec_seconds, codec_peak = traced(
+        fasta_matrix, fasta_path
+    )
+    return {
+        'sequences': matrix.shape[0],
+        'alignment_length': matrix.shape[1],
+        'unicode_seconds': unicode_seconds,
+        'unicode_matrix_megabytes': unicode_matrix.nbytes / 2**20,
+        'unicode_peak_megabytes': unicode_peak / 2**20,
+        'codec_seconds': codec_seconds,
+        'codec_matrix_megabytes': matrix.nbytes / 2**20,
+        'codec_peak_megabytes': codec_peak / 2**20,
+        'speedup': unicode_seconds / codec_seconds,
+        'identical_headers': unicode_headers == headers,
+        'identical_alignments': bool(np.array_equal(
+            unicode_matrix.view(np.uint32) != unicode_matrix.view(np.uint32)[0],
+            matrix != matrix[0]
+        ))
+    }
+
+
+def per_pair_hamming_distances(sequences):
+    distances = np.zeros((len(sequences), len(sequences)), dtype=np.int64)
+    for i in range(len(sequences)):
+        for j in range(len(sequences)):
+            distances[i, j] = (sequences[i, :] != sequences[j, :]).sum()
+    return distances
+
+
+def hamming_benchmark(
+        sizes=(100, 300, 1000), alignment_length=9000, threads=1,
+        per_pair_limit=300, seed=1
+        ):
+    np.random.seed(seed)
+    results = []
+    for size in sizes:
+        sequences = np.random.randint(
+            5, size=(size, alignment_length)
+        ).astype(np.uint8)
+        distances, seconds = timed(hamming_distances, sequences, threads=threads)
+        result = {
+            'sequences': size,
+            'blocked_seconds': seconds
+        }
+        if size <= per_pair_limit:
+            per_pair, per_pair_seconds = timed(
+                per_pair_hamming_distances, sequences
+            )
+            result['per_pair_seconds'] = per_pair_seconds
+            result['identical_distances'] = bool(
+                np.array_equal(per_pair, distances)
+            )
+        results.append(result)
+    return results
+
+
+def local_alignment_benchmark(fasta_path, reference_path, processes=1):
+    sequences = list(SeqIO.parse(fasta_path, 'fasta'))
+    aligned, seconds = timed(
+        local_aligned_sequences, sequences, reference_path, processes
+    )
+    result = {
+        'sequences': len(sequences),
+        'in_process_seconds': seconds
+    }
+    if shutil.which('water'):
+        water_aligned, water_seconds = timed(
+            water_aligned_sequences, sequences, reference_path
+        )
+        result['water_seconds'] = water_seconds
+        result['speedup'] = water_seconds / seconds
+        result['identical_alignments'] = [
+            (record.id, str(record.seq)) for record in aligned
+        ] == [
+            (record.id, str(record.seq)) for record in water_aligned
+        ]
+    return result
+
+
+def synthetic_mixture(
+        number_of_strains=3, diversity=.02, reference_length=3000, seed=1
+        ):
+    # Strains in the style of simulations.json: LANL-like ids at equal
+    # frequencies, each differing from a shared reference at a fraction
+    # diversity of its sites.
+    np.random.seed(seed)
+    bases = np.frombuffer(b'ACGT', dtype=np.uint8)
+    reference = np.random.randint(4, size=reference_length)
+    haplotypes = np.tile(reference, (number_of_strains, 1))
+    number_of_mutations = int(diversity * reference_length)
+    for haplotype in haplotypes:
+        sites = np.random.choice(
+            reference_length, number_of_mutations, replace=False
+        )
+        haplotype[sites] = (
+            haplotype[sites] + np.random.randint(1, 4, number_of_mutations)
+        ) % 4
+    return {
+        'strains': [
+            {
+                'lanl_id': 'B.US.2008.SYN%d' % i,
+                'frequency': 1 / number_of_strains
+            }
+            for i in range(number_of_strains)
+        ],
+        'reference': bases[reference].tobytes().decode('ascii'),
+        'haplotypes': bases[haplotypes]
+    }
+
+
+def synthetic_bam(
+        bam_path, mixture, number_of_reads, read_length=150,
+        error_rate=.002, deletion_rate=.05, seed=1, chunk_size=100000
+        ):
+    np.random.seed(seed)
+    haplotypes = mixture['haplotypes']
+    number_of_strains, reference_length = haplotypes.shape
+    frequencies = [strain['frequency'] for strain in mixture['strains']]
+    header = {
+        'HD': {'VN': '1.0', 'SO': 'coordinate'},
+        'SQ': [{'LN': reference_length, 'SN': 'reference'}]
+    }
+    starts = np.sort(np.random.randint(
+        0, reference_length - read_length - 3, number_of_reads
+    ))
+    qualities = pysam.qualitystring_to_array('I' * read_length)
+    positions = np.arange(read_length)
+    with pysam.AlignmentFile(bam_path, 'wb', header=header) as bam:
+        for chunk_start in range(0, number_of_reads, chunk_size):
+            chunk_starts = starts[chunk_start: chunk_start + chunk_size]
+            size = len(chunk_starts)
+            strains = np.random.choice(number_of_strains, size, p=frequencies)
+            deleted = np.where(
+                np.random.rand(size) < deletion_rate,
+                np.random.randint(1, 4, size), 0
+            )
+            deletion_starts = np.random.randint(
+                read_length // 4, 3 * read_length // 4, size
+            )
+            reference_positions = chunk_starts[:, np.newaxis] + positions \
+                + deleted[:, np.newaxis] \
+                * (positions >= deletion_starts[:, np.newaxis])
+            sequences = haplotypes[strains[:, np.newaxis], reference_positions]
+            errors = np.random.rand(size, read_length) < error_rate
+            sequences[errors] = np.frombuffer(b'ACGT', dtype=np.uint8)[
+                np.random.randint(4, size=errors.sum())
+            ]
+            for i in range(size):
+                read = pysam.AlignedSegment()
+                read.query_name = '%s.%d' % (
+                    mixture['strains'][strains[i]]['lanl_id'], chunk_start + i
+                )
+                read.reference_id = 0
+                read.reference_start = int(chunk_starts[i])
+                if deleted[i]:
+                    read.cigartuples = [
+                        (0, int(deletion_starts[i])), (2, int(deleted[i])),
+                        (0, read_length - int(deletion_starts[i]))
+                    ]
+                else:
+                    read.cigartuples = [(0, read_length)]
+                read.query_sequence = sequences[i].tobytes().decode('ascii')
+                read.query_qualities = qualities
+                read.mapping_quality = 60
+                bam.write(read)
+    pysam.index(bam_path)
+
+
+def write_synthetic_alignment(fasta_path, mixture, reconstructions=4, seed=1):
+    # Truth plus a few noisy reconstructions per strain, shaped like the
+    # truth_and_haplotypes alignment that pairwise_distance_csv reads.
+    np.random.seed(seed)
+    with open(fasta_path, 'w') as fasta_file:
+        for strain, haplotype in zip(mixture['strains'], mixture['haplotypes']):
+            fasta_file.write('>%s\n%s\n' % (
+                strain['lanl_id'], haplotype.tobytes().decode('ascii')
+            ))
+        for i in range(reconstructions * len(mixture['strains'])):
+            haplotype = mixture['haplotypes'][
+                i % len(mixture['strains'])
+            ].copy()
+            errors = np.random.rand(len(haplotype)) < .005
+            haplotype[errors] = ord('-')
+            fasta_file.write('>quasispecies_%d\n%s\n' % (
+                i, haplotype.tobytes().decode('ascii')
+            ))
+
+
+def suite_stage(name, function, *args, **kwargs):
+    # tracemalloc slows allocation heavy stages several fold, so the timing
+    # run is untraced and the peak comes from a second, traced run.
+    result, seconds = timed(function, *args, **kwargs)
+    _, _, peak = traced(function, *args, **kwargs)
+    return result, {
+        'stage': name,
+        'seconds': seconds,
+        'peak_megabytes': peak / 2**20
+    }
+
+
+def mixture_benchmark(bam_path, fasta_path, csv_path):
+    alignment = pysam.AlignmentFile(bam_path, 'rb')
+    # The pileup cache is bypassed so that every stage decodes the BAM.
+    _, pileup = suite_stage(
+        'pileup', all_read_count_data, alignment, cache=False
+    )
+    covarying_sites, covarying = suite_stage(
+        'covarying_sites', get_covarying_sites, alignment, cache=False
+    )
+    covarying['covarying_sites'] = len(covarying_sites)
+    superreads, superread = suite_stage(
+        'superreads', obtain_superreads, alignment, covarying_sites
+    )
+    superread['superreads'] = len(superreads)
+    alignment.close()
+    score_matrix, score = suite_stage(
+        'score_matrix', get_score_matrix, superreads, 0, 0
+    )
+    score['nonzero_edges'] = int(score_matrix.nnz)
+    stages = [pileup, covarying, superread, score]
+    if len(superreads) > 3:
+        _, embedding = suite_stage(
+            'spectral_embedding', perform_spectral_embedding, superreads, 0, 0
+        )
+        stages.append(embedding)
+    _, distance = suite_stage(
+        'pairwise_distance', pairwise_distance_csv, fasta_path, csv_path
+    )
+    stages.append(distance)
+    return stages
+
+
+def scaling_exponent(reads, seconds):
+    if len(reads) < 2 or min(seconds) <= 0:
+        return None
+    return float(np.polyfit(np.log(reads), np.log(seconds), 1)[0])
+
+
+def scaling_curves(results):
+    curves = {}
+    for result in results:
+        key = (result['stage'], result['diversity'])
+        curves.setdefault(key, []).append(result)
+    scaling = []
+    for (stage, diversity), points in curves.items():
+        points = sorted(points, key=lambda point: point['reads'])
+        reads = [point['reads'] for point in points]
+        seconds = [point['seconds'] for point in points]
+        scaling.append({
+            'stage': stage,
+            'diversity': diversity,
+            'reads': reads,
+            'seconds': seconds,
+            'peak_megabytes': [point['peak_megabytes'] for point in points],
+            'exponent': scaling_exponent(reads, seconds)
+        })
+    return scaling
+
+
+def suite_benchmark(
+        depths=(10000, 100000, 1000000), diversities=(.01, .05),
+        number_of_strains=3, reference_length=3000, seed=1
+        ):
+    # Heavy modules load lazily, so import them up front to keep their
+    # import time out of whichever stage happens to use them first.
+    for module in heavy_modules:
+        importlib.import_module(module)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for diversity in diversities:
+            mixture = synthetic_mixture(
+                number_of_strains, diversity, reference_length, seed
+            )
+            fasta_path = os.path.join(tmp_dir, 'alignment.fasta')
+            write_synthetic_alignment(fasta_path, mixture, seed=seed)
+            for depth in depths:
+                bam_path = os.path.join(tmp_dir, 'reads.bam')
+                _, bam_seconds = timed(
+                    synthetic_bam, bam_path, mixture, depth, seed=seed
+                )
+                for stage in mixture_benchmark(
+                        bam_path, fasta_path,
+                        os.path.join(tmp_dir, 'distances.csv')
+                        ):
+                    stage.update({'reads': depth, 'diversity': diversity})
+                    results.append(stage)
+                sys.stderr.write(
+                    'diversity %g, %d reads: simulated in %.1f seconds\n' % (
+                        diversity, depth, bam_seconds
+                    )
+                )
+    return {
+        'configuration': {
+            'depths': list(depths),
+            'diversities': list(diversities),
+            'strains': number_of_strains,
+            'reference_length': reference_length,
+            'seed': seed
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pysam': pysam.__version__,
+            'machine': platform.machine(),
+            'processor_count': os.cpu_count()
+        },
+        'results': results,
+        'scaling': scaling_curves(results)
+    }
+
+
+def compare_benchmarks(
+        baseline_path, candidate_path, threshold=1.2, minimum_seconds=.05
+        ):
+    # Stages are matched on stage, depth and diversity. Timings below
+    # minimum_seconds in both runs are too noisy to flag.
+    with open(baseline_path) as json_file:
+        baseline = json.load(json_file)
+    with open(candidate_path) as json_file:
+        candidate = json.load(json_file)
+    baseline_results = {
+        (result['stage'], result['reads'], result['diversity']): result
+        for result in baseline['results']
+    }
+    comparisons = []
+    for result in candidate['results']:
+        key = (result['stage'], result['reads'], result['diversity'])
+        if not key in baseline_results:
+            continue
+        previous = baseline_results[key]
+        time_ratio = result['seconds'] / max(previous['seconds'], 1e-9)
+        memory_ratio = result['peak_megabytes'] \
+            / max(previous['peak_megabytes'], 1e-9)
+        noisy = max(result['seconds'], previous['seconds']) < minimum_seconds
+        comparisons.append({
+            'stage': result['stage'],
+            'reads': result['reads'],
+            'diversity': result['diversity'],
+            'baseline_seconds': previous['seconds'],
+            'candidate_seconds': result['seconds'],
+            'time_ratio': time_ratio,
+            'memory_ratio': memory_ratio,
+            'slower': not noisy and time_ratio > threshold,
+            'more_memory': memory_ratio > threshold
+        })
+    return {
+        'threshold': threshold,
+        'compared': len(comparisons),
+        'regressions': [
+            comparison for comparison in comparisons
+            if comparison['slower'] or comparison['more_memory']
+        ],
+        'comparisons': comparisons
+    }
+
+
+heavy_modules = [
+    'pandas', 'pysam', 'Bio.SeqIO', 'scipy.sparse', 'sklearn.manifold',
+    'matplotlib.pyplot', 'seaborn'
+]
+
+import_time_script = """
+import importlib, json, sys, time
+start = time.perf_counter()
+import py
+package_seconds = time.perf_counter() - start
+loaded = [module for module in %r if module in sys.modules]
+start = time.perf_counter()
+for module in %r:
+    importlib.import_module(module)
+print(json.dumps({
+    'package_seconds': package_seconds,
+    'heavy_seconds': time.perf_counter() - start,
+    'heavy_modules_loaded': loaded
+}))
+"""
+
+
+def cold_import(package_root):
+    script = import_time_script % (heavy_modules, heavy_modules)
+    output = subprocess.check_output(
+        [sys.executable, '-c', script], cwd=package_root
+    )
+    return json.loads(output)
+
+
+def import_time_benchmark(repeats=5):
+    # Each import happens in a fresh interpreter so that nothing is cached
+    # in sys.modules. Importing the heavy dependencies afterwards gives the
+    # cold start of an eager package, which is what every job used to pay.
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    runs = [cold_import(package_root) for i in range(repeats)]
+    lazy_seconds = np.median([run['package_seconds'] for run in runs])
+    eager_seconds = np.median([
+        run['package_seconds'] + run['heavy_seconds'] for run in runs
+    ])
+    return {
+        'repeats': repeats,
+        'lazy_seconds': lazy_seconds,
+        'eager_seconds': eager_seconds,
+        'speedup': eager_seconds / lazy_seconds,
+        'heavy_modules_loaded': runs[0]['heavy_modules_loaded']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark ACME hot paths against their previous implementations.'
+    )
+    subparsers = parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    pileup_parser = subparsers.add_parser(
+        'pileup', help='per-read versus batched pileup on a sorted, indexed BAM'
+    )
+    pileup_parser.add_argument('-i', '--input', help='input BAM file')
+
+    site_table_parser = subparsers.add_parser(
+        'site_table', help='per-row versus columnar site table on synthetic counts'
+    )
+    site_table_parser.add_argument(
+        '-l', '--length', type=int, default=10000, help='reference length'
+    )
+    site_table_parser.add_argument(
+        '-d', '--depth', type=int, default=1000, help='reads per site'
+    )
+
+    vacs_parser = subparsers.add_parser(
+        'vacs', help='per-read cost of VACS extraction against number of covarying sites'
+    )
+    vacs_parser.add_argument('-i', '--input', help='input BAM file')
+    vacs_parser.add_argument(
+        '-n', '--reads', type=int, default=2000, help='number of reads to extract'
+    )
+    vacs_parser.add_argument(
+        '-s', '--sites', type=int, nargs='+', default=[10, 50, 100, 500, 1000],
+        help='numbers of covarying sites'
+    )
+
+    score_matrix_parser = subparsers.add_parser(
+        'score_matrix', help='scaling of the superread score matrix on synthetic superreads'
+    )
+    score_matrix_parser.add_argument(
+        '-s', '--sizes', type=int, nargs='+',
+        default=[1000, 3000, 10000, 30000, 100000],
+        help='numbers of superreads'
+    )
+    score_matrix_parser.add_argument(
+        '-l', '--per-pair-limit', type=int, default=2000,
+        help='largest size to also run the baseline and corrected per-pair '
+        'implementations on'
+    )
+
+    fasta_load_parser = subparsers.add_parser(
+        'fasta_load', help='unicode versus uint8 codec loading of a FASTA alignment'
+    )
+    fasta_load_parser.add_argument(
+        '-i', '--input', help='input FASTA alignment, e.g. LANL-HIV-aligned.fasta'
+    )
+
+    hamming_parser = subparsers.add_parser(
+        'hamming', help='per-pair versus blocked all-pairs Hamming distances'
+    )
+    hamming_parser.add_argument(
+        '-s', '--sizes', type=int, nargs='+', default=[100, 300, 1000],
+        help='numbers of sequences'
+    )
+    hamming_parser.add_argument(
+        '-l', '--length', type=int, default=9000, help='alignment length'
+    )
+    hamming_parser.add_argument(
+        '-t', '--threads', type=int, default=1, help='threads for the blocked engine'
+    )
+
+    local_alignment_parser = subparsers.add_parser(
+        'local_alignment',
+        help='in-process Smith-Waterman versus one water subprocess per sequence'
+    )
+    local_alignment_parser.add_argument(
+        '-i', '--input', help='input FASTA of truth genomes'
+    )
+    local_alignment_parser.add_argument(
+        '-r', '--reference', help='gene reference FASTA'
+    )
+    local_alignment_parser.add_argument(
+        '-p', '--processes', type=int, default=1, help='worker processes'
+    )
+
+    import_time_parser = subparsers.add_parser(
+        'import_time', help='cold-start time of import py, lazy versus eager'
+    )
+    import_time_parser.add_argument(
+        '-r', '--repeats', type=int, default=5, help='fresh interpreters to time'
+    )
+
+    suite_parser = subparsers.add_parser(
+        'suite',
+        help='time and trace every ACME stage on synthetic BAMs of growing depth'
+    )
+    suite_parser.add_argument(
+        '-d', '--depths', type=int, nargs='+',
+        default=[10000, 100000, 1000000], help='numbers of reads'
+    )
+    suite_parser.add_argument(
+        '-v', '--diversities', type=float, nargs='+', default=[.01, .05],
+        help='fractions of sites at which each strain leaves the reference'
+    )
+    suite_parser.add_argument(
+        '-n', '--strains', type=int, default=3, help='strains in the mixture'
+    )
+    suite_parser.add_argument(
+        '-l', '--length', type=int, default=3000, help='reference length'
+    )
+    suite_parser.add_argument('-o', '--output', help='JSON file for the results')
+
+    compare_parser = subparsers.add_parser(
+        'compare', help='flag stages that slowed down between two suite results'
+    )
+    compare_parser.add_argument('baseline', help='earlier suite JSON')
+    compare_parser.add_argument('candidate', help='later suite JSON')
+    compare_parser.add_argument(
+        '-t', '--threshold', type=float, default=1.2,
+        help='ratio of candidate to baseline that counts as a regression'
+    )
+    compare_parser.add_argument(
+        '-m', '--minimum-seconds', type=float, default=.05,
+        help='timings below this in both runs are not flagged'
+    )
+
+    args = parser.parse_args()
+    if args.benchmark == 'pileup':
+        result = pileup_benchmark(args.input)
+    elif args.benchmark == 'site_table':
+        result = site_table_benchmark(args.length, args.depth)
+    elif args.benchmark == 'vacs':
+        result = vacs_benchmark(args.input, args.sites, args.reads)
+    elif args.benchmark == 'score_matrix':
+        result = score_matrix_benchmark(args.sizes, args.per_pair_limit)
+    elif args.benchmark == 'fasta_load':
+        result = fasta_load_benchmark(args.input)
+    elif args.benchmark == 'hamming':
+        result = hamming_benchmark(args.sizes, args.length, args.threads)
+    elif args.benchmark == 'local_alignment':
+        result = local_alignment_benchmark(
+            args.input, args.reference, args.processes
+        )
+    elif args.benchmark == 'import_time':
+        result = import_time_benchmark(args.repeats)
+    elif args.benchmark == 'suite':
+        result = suite_benchmark(
+            args.depths, args.diversities, args.strains, args.length
+        )
+        if args.output:
+            with open(args.output, 'w') as json_file:
+                json.dump(result, json_file, indent=2)
+    elif args.benchmark == 'compare':
+        result = compare_benchmarks(
+            args.baseline, args.candidate, args.threshold, args.minimum_seconds
+        )
+    print(json.dumps(result, indent=2))
+    if args.benchmark == 'compare' and result['regressions']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import numpy as np
+
+
+nucleotides = b'ACGT-N'
+A, C, G, T, GAP, N = range(len(nucleotides))
+
+# Every byte gets its own code so that comparing codes is the same as
+# comparing characters; A/C/G/T/-/N come first so they can index arrays.
+decode_table = np.concatenate([
+    np.frombuffer(nucleotides, dtype=np.uint8),
+    np.setdiff1d(
+        np.arange(256, dtype=np.uint8),
+        np.frombuffer(nucleotides, dtype=np.uint8)
+    )
+])
+encode_table = np.argsort(decode_table).astype(np.uint8)
+encode_translation = encode_table.tobytes()
+
+
+def encode_bytes(sequence_bytes):
+    return np.frombuffer(
+        sequence_bytes.translate(encode_translation), dtype=np.uint8
+    )
+
+
+def encode_sequence(sequence):
+    return encode_bytes(str(sequence).encode('ascii'))
+
+
+def decode_sequence(codes):
+    return decode_table[codes].tobytes().decode('ascii')
+
+
+def encode_records(records):
+    headers = []
+    sequences = []
+    for record in records:
+        headers.append(record.id)
+        sequences.append(str(record.seq).encode('ascii'))
+    return headers, sequence_matrix(sequences)
+
+
+def sequence_matrix(sequences):
+    lengths = set(len(sequence) for sequence in sequences)
+    if len(lengths) > 1:
+        raise ValueError(
+            'Sequences have differing lengths: %s' % sorted(lengths)
+        )
+    width = lengths.pop() if len(lengths) == 1 else 0
+    matrix = np.empty((len(sequences), width), dtype=np.uint8)
+    for row, sequence in enumerate(sequences):
+        matrix[row] = encode_bytes(sequence)
+    return matrix
+
+
+def fasta_records(fasta_path):
+    with open(fasta_path, 'rb') as fasta_file:
+        data = fasta_file.read()
+    headers = []
+    sequences = []
+    records = data.split(b'\n>')
+    if records[0].startswith(b'>'):
+        records[0] = records[0][1:]
+    else:
+        records = records[1:]
+    for record in records:
+        header, _, sequence = record.partition(b'\n')
+        headers.append((header.decode('ascii').split(None, 1) or [''])[0])
+        sequences.append(
+            sequence.replace(b'\n', b'').replace(b'\r', b'').replace(b' ', b'')
+        )
+    return headers, sequences
+
+
+def fasta_matrix(fasta_path):
+    headers, sequences = fasta_records(fasta_path)
+    return headers, sequence_matrix(sequences)
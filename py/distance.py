@@ -0,0 +1,46 @@
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+
+def hamming_block(first, second):
+    return np.count_nonzero(
+        first[:, np.newaxis, :] != second[np.newaxis, :, :], axis=2
+    )
+
+
+def distance_blocks(number_of_first, number_of_second, rows, symmetric):
+    for i in range(0, number_of_first, rows):
+        for j in range(i if symmetric else 0, number_of_second, rows):
+            yield i, j
+
+
+def hamming_distances(first, second=None, block_bytes=2**20, threads=1):
+    symmetric = second is None
+    second = first if symmetric else second
+    if first.shape[1] != second.shape[1]:
+        raise ValueError(
+            'Sequences have differing lengths: %d and %d' %
+            (first.shape[1], second.shape[1])
+        )
+    # Square blocks whose broadcast comparison fits in block_bytes.
+    rows = max(1, int(np.sqrt(block_bytes / max(first.shape[1], 1))))
+    distances = np.zeros((len(first), len(second)), dtype=np.int64)
+
+    def fill(block):
+        i, j = block
+        distances[i: i+rows, j: j+rows] = hamming_block(
+            first[i: i+rows], second[j: j+rows]
+        )
+
+    blocks = distance_blocks(len(first), len(second), rows, symmetric)
+    if threads > 1:
+        with ThreadPool(threads) as pool:
+            pool.map(fill, list(blocks))
+    else:
+        for block in blocks:
+            fill(block)
+    if symmetric:
+        upper = np.triu(distances)
+        distances = upper + np.triu(upper, 1).T
+    return distances
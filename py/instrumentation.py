@@ -0,0 +1,178 @@
+import csv
+import glob
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager
+
+
+PROFILE_EXTENSION = '.profile.json'
+PROFILE_ENVIRONMENT_VARIABLE = 'ACME_INSTRUMENT'
+
+# Only the outermost profiled entry point records; outside of one, a stage
+# only hands back an unused counts dict.
+active_profile = None
+
+
+def instrumentation_enabled(instrument=None):
+    if instrument is None:
+        return os.environ.get(PROFILE_ENVIRONMENT_VARIABLE, '') not in ('', '0')
+    return bool(instrument)
+
+
+def peak_rss_megabytes():
+    # The process high-water mark over its whole lifetime.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_peak_rss_megabytes():
+    # VmHWM, the high-water mark since it was last reset, where /proc has it.
+    try:
+        with open('/proc/self/status') as status_file:
+            for line in status_file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    # Linux resets VmHWM to the current RSS when 5 is written to clear_refs.
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs_file:
+            clear_refs_file.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def cpu_seconds():
+    # Pool workers are counted once they have been joined.
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def profile_path(output_path):
+    return output_path + PROFILE_EXTENSION
+
+
+@contextmanager
+def stage(name):
+    counts = {}
+    if active_profile is None:
+        yield counts
+        return
+    # Resetting the high-water mark would hide what enclosing stages have
+    # used so far, so that is folded into their peaks first.
+    open_peaks = active_profile['open_peaks']
+    previous_peak = current_peak_rss_megabytes()
+    if previous_peak is not None and reset_peak_rss():
+        for index in range(len(open_peaks)):
+            open_peaks[index] = max(open_peaks[index], previous_peak)
+        open_peaks.append(0)
+    else:
+        open_peaks.append(None)
+    wall_start = time.perf_counter()
+    cpu_start = cpu_seconds()
+    try:
+        yield counts
+    finally:
+        stage_peak = open_peaks.pop()
+        stages = active_profile['stages']
+        if not name in stages:
+            stages[name] = {
+                'calls': 0, 'wall_seconds': 0, 'cpu_seconds': 0, 'counts': {}
+            }
+        record = stages[name]
+        record['calls'] += 1
+        record['wall_seconds'] += time.perf_counter() - wall_start
+        record['cpu_seconds'] += cpu_seconds() - cpu_start
+        if stage_peak is not None:
+            stage_peak = max(stage_peak, current_peak_rss_megabytes())
+            record['peak_rss_megabytes'] = max(
+                record.get('peak_rss_megabytes', 0), stage_peak
+            )
+        for key, value in counts.items():
+            record['counts'][key] = record['counts'].get(key, 0) + int(value)
+
+
+@contextmanager
+def profiled(entry_point, output_path, instrument=None):
+    global active_profile
+    if active_profile is not None or not instrumentation_enabled(instrument):
+        yield
+        return
+    active_profile = {'stages': {}, 'open_peaks': []}
+    wall_start = time.perf_counter()
+    cpu_start = cpu_seconds()
+    try:
+        yield
+    finally:
+        profile = active_profile
+        active_profile = None
+    with open(profile_path(output_path), 'w') as json_file:
+        json.dump({
+            'entry_point': entry_point,
+            'output': output_path,
+            'wall_seconds': time.perf_counter() - wall_start,
+            'cpu_seconds': cpu_seconds() - cpu_start,
+            'process_peak_rss_megabytes': peak_rss_megabytes(),
+            'stages': [
+                dict(name=name, **record)
+                for name, record in profile['stages'].items()
+            ]
+        }, json_file, indent=2)
+
+
+def profile_rows(profile_paths):
+    rows = []
+    for path in profile_paths:
+        with open(path) as json_file:
+            profile = json.load(json_file)
+        for record in profile['stages']:
+            row = {
+                'profile': path,
+                'entry_point': profile['entry_point'],
+                'stage': record['name'],
+                'calls': record['calls'],
+                'wall_seconds': record['wall_seconds'],
+                'cpu_seconds': record['cpu_seconds'],
+                'peak_rss_megabytes': record.get('peak_rss_megabytes'),
+                'process_peak_rss_megabytes':
+                    profile.get('process_peak_rss_megabytes')
+            }
+            row.update(record['counts'])
+            rows.append(row)
+    return rows
+
+
+def sidecar_profiles(output_paths):
+    # Every profile written into the directories holding the given outputs.
+    directories = sorted(set(
+        os.path.dirname(path) for path in output_paths
+    ))
+    return [
+        path
+        for directory in directories
+        for path in sorted(glob.glob(
+            os.path.join(directory, '*' + PROFILE_EXTENSION)
+        ))
+    ]
+
+
+def write_profile_csv(profile_paths, output_csv, extra_fields=None):
+    rows = profile_rows(profile_paths)
+    if extra_fields is not None:
+        for row in rows:
+            row.update(extra_fields(row['profile']))
+    field_names = []
+    for row in rows:
+        for key in row:
+            if not key in field_names:
+                field_names.append(key)
+    with open(output_csv, 'w') as csvfile:
+        writer = csv.DictWriter(csvfile, field_names)
+        writer.writeheader()
+        writer.writerows(rows)
@@ -0,0 +1,104 @@
+from multiprocessing import Pool
+
+import numpy as np
+
+
+# EDNAFULL (NUC.4.4), the default nucleotide matrix of EMBOSS water.
+ednafull_alphabet = 'ATGCSWRYKMBVHDNU'
+ednafull = np.array([
+    [5, -4, -4, -4, -4, 1, 1, -4, -4, 1, -4, -1, -1, -1, -2, -4],
+    [-4, 5, -4, -4, -4, 1, -4, 1, 1, -4, -1, -4, -1, -1, -2, 5],
+    [-4, -4, 5, -4, 1, -4, 1, -4, 1, -4, -1, -1, -4, -1, -2, -4],
+    [-4, -4, -4, 5, 1, -4, -4, 1, -4, 1, -1, -1, -1, -4, -2, -4],
+    [-4, -4, 1, 1, -1, -4, -2, -2, -2, -2, -1, -1, -3, -3, -1, -4],
+    [1, 1, -4, -4, -4, -1, -2, -2, -2, -2, -3, -3, -1, -1, -1, 1],
+    [1, -4, 1, -4, -2, -2, -1, -4, -2, -2, -3, -1, -3, -1, -1, -4],
+    [-4, 1, -4, 1, -2, -2, -4, -1, -2, -2, -1, -3, -1, -3, -1, 1],
+    [-4, 1, 1, -4, -2, -2, -2, -2, -1, -4, -1, -3, -3, -1, -1, 1],
+    [1, -4, -4, 1, -2, -2, -2, -2, -4, -1, -3, -1, -1, -3, -1, -4],
+    [-4, -1, -1, -1, -1, -3, -3, -1, -1, -3, -1, -2, -2, -2, -1, -1],
+    [-1, -4, -1, -1, -1, -3, -1, -3, -3, -1, -2, -1, -2, -2, -1, -4],
+    [-1, -1, -4, -1, -3, -1, -3, -1, -3, -1, -2, -2, -1, -2, -1, -1],
+    [-1, -1, -1, -4, -3, -1, -1, -3, -1, -3, -2, -2, -2, -1, -1, -1],
+    [-2, -2, -2, -2, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -2],
+    [-4, 5, -4, -4, -4, 1, -4, 1, 1, -4, -1, -4, -1, -1, -2, 5]
+], dtype=np.int32)
+
+ednafull_index = np.full(256, ednafull_alphabet.index('N'), dtype=np.intp)
+for i, character in enumerate(ednafull_alphabet):
+    ednafull_index[ord(character)] = i
+    ednafull_index[ord(character.lower())] = i
+
+# Half-integer gap penalties are scored in units of one half.
+SCALE = 2
+
+
+def residue_indices(sequence):
+    sequence_bytes = np.frombuffer(str(sequence).encode('ascii'), dtype=np.uint8)
+    return ednafull_index[sequence_bytes]
+
+
+def local_alignment(query, reference, gap_open=10, gap_extend=.5):
+    # Gotoh recursion one reference residue at a time, vectorized along the
+    # query. Gaps along the query come from a running maximum, and each cell
+    # carries the query position its path started at.
+    gap_open = int(round(SCALE * gap_open))
+    gap_extend = int(round(SCALE * gap_extend))
+    profile = SCALE * ednafull[:, residue_indices(query)]
+    columns = profile.shape[1]
+    offsets = gap_extend * np.arange(columns + 1, dtype=np.int32)
+    positions = np.arange(columns + 1, dtype=np.int32)
+    H = np.zeros(columns + 1, dtype=np.int32)
+    H_start = np.zeros(columns + 1, dtype=np.int32)
+    E = np.full(columns + 1, -gap_open, dtype=np.int32)
+    E_start = np.zeros(columns + 1, dtype=np.int32)
+    H0 = np.zeros(columns + 1, dtype=np.int32)
+    H0_start = np.zeros(columns + 1, dtype=np.int32)
+    F = np.full(columns + 1, np.iinfo(np.int32).min // 2, dtype=np.int32)
+    F_start = np.zeros(columns + 1, dtype=np.int32)
+    best = (0, 0, 0)
+    for residue in residue_indices(reference):
+        open_vertical = H - gap_open
+        extend_vertical = E - gap_extend
+        from_open = open_vertical >= extend_vertical
+        E = np.where(from_open, open_vertical, extend_vertical)
+        E_start = np.where(from_open, H_start, E_start)
+
+        np.maximum(H[:-1] + profile[residue], 0, out=H0[1:])
+        H0_start[1:] = np.where(H[:-1] > 0, H_start[:-1], positions[:-1])
+        from_vertical = E > H0
+        H0 = np.where(from_vertical, E, H0)
+        H0_start = np.where(from_vertical, E_start, H0_start)
+
+        # F[j] = max over k < j of H0[k] - gap_open - (j - 1 - k)*gap_extend
+        shifted = H0 + offsets
+        running = np.maximum.accumulate(shifted)
+        source = np.maximum.accumulate(np.where(shifted == running, positions, 0))
+        F[1:] = running[:-1] - gap_open - offsets[:-1]
+        F_start[1:] = H0_start[source[:-1]]
+        from_horizontal = F > H0
+        H = np.where(from_horizontal, F, H0)
+        H_start = np.where(from_horizontal, F_start, H0_start)
+
+        j = H.argmax()
+        if H[j] > best[0]:
+            best = (H[j], H_start[j], j)
+    score, query_start, query_end = best
+    return score / SCALE, int(query_start), int(query_end)
+
+
+def local_alignment_arguments(arguments):
+    return local_alignment(*arguments)
+
+
+def batch_local_alignment(
+        queries, reference, gap_open=10, gap_extend=.5, processes=1
+        ):
+    arguments = [
+        (str(query), str(reference), gap_open, gap_extend)
+        for query in queries
+    ]
+    if processes > 1:
+        with Pool(processes) as pool:
+            return pool.map(local_alignment_arguments, arguments)
+    return [local_alignment_arguments(argument) for argument in arguments]
@@ -0,0 +1,208 @@
+from multiprocessing import Pool
+
+import numpy as np
+
+
+# CIGAR operations, in pysam's numbering: M I D N S H P = X B
+consumes_query = np.array([1, 1, 0, 0, 1, 0, 0, 1, 1, 0], dtype=bool)
+consumes_reference = np.array([1, 0, 1, 1, 0, 0, 0, 1, 1, 0], dtype=bool)
+aligns_bases = np.array([1, 0, 0, 0, 0, 0, 0, 1, 1, 0], dtype=bool)
+DELETION = 2
+
+base_codes = np.full(256, 255, dtype=np.uint8)
+base_codes[np.frombuffer(b'ACGT', dtype=np.uint8)] = np.arange(4)
+DELETION_CODE = 4
+NUMBER_OF_CODES = 5
+
+
+def read_batches(reads, batch_size=20000, query_names=False):
+    batch = new_batch()
+    for read in reads:
+        cigar = read.cigartuples
+        sequence = read.query_sequence
+        if not cigar or sequence is None:
+            continue
+        batch['reference_starts'].append(read.reference_start)
+        batch['operation_counts'].append(len(cigar))
+        batch['cigars'].extend(cigar)
+        batch['sequences'].append(sequence)
+        if query_names:
+            batch['query_names'].append(read.query_name)
+        if len(batch['sequences']) == batch_size:
+            yield finish_batch(batch)
+            batch = new_batch()
+    if len(batch['sequences']) > 0:
+        yield finish_batch(batch)
+
+
+def new_batch():
+    return {
+        'reference_starts': [],
+        'operation_counts': [],
+        'cigars': [],
+        'sequences': [],
+        'query_names': []
+    }
+
+
+def finish_batch(batch):
+    cigars = np.array(batch['cigars'], dtype=np.int64).reshape(-1, 2)
+    sequence_lengths = np.array(
+        [len(sequence) for sequence in batch['sequences']], dtype=np.int64
+    )
+    return {
+        'reference_starts': np.array(batch['reference_starts'], dtype=np.int64),
+        'operation_counts': np.array(batch['operation_counts'], dtype=np.int64),
+        'operations': cigars[:, 0],
+        'lengths': cigars[:, 1],
+        'sequence': np.frombuffer(
+            ''.join(batch['sequences']).encode('ascii'), dtype=np.uint8
+        ),
+        'sequence_offsets': np.cumsum(sequence_lengths) - sequence_lengths,
+        'query_names': batch['query_names']
+    }
+
+
+def exclusive_cumsum_by_group(values, group_sizes):
+    cumulative = np.cumsum(values) - values
+    group_starts = np.cumsum(group_sizes) - group_sizes
+    return cumulative - np.repeat(cumulative[group_starts], group_sizes)
+
+
+def expand_segments(starts, lengths):
+    segment_index = np.repeat(np.arange(len(lengths)), lengths)
+    segment_starts = np.cumsum(lengths) - lengths
+    offsets = np.arange(lengths.sum()) - segment_starts[segment_index]
+    return segment_index, starts[segment_index] + offsets
+
+
+def cigar_segments(batch):
+    operations = batch['operations']
+    lengths = batch['lengths']
+    counts = batch['operation_counts']
+    read_index = np.repeat(np.arange(len(counts)), counts)
+    reference_offsets = exclusive_cumsum_by_group(
+        lengths * consumes_reference[operations], counts
+    )
+    query_offsets = exclusive_cumsum_by_group(
+        lengths * consumes_query[operations], counts
+    )
+    return {
+        'read_index': read_index,
+        'reference_starts': batch['reference_starts'][read_index] + reference_offsets,
+        'query_starts': batch['sequence_offsets'][read_index] + query_offsets,
+        'operations': operations,
+        'lengths': lengths
+    }
+
+
+def batch_aligned_pairs(batch, segments=None):
+    if segments is None:
+        segments = cigar_segments(batch)
+    matched = aligns_bases[segments['operations']]
+    segment_index, reference_positions = expand_segments(
+        segments['reference_starts'][matched], segments['lengths'][matched]
+    )
+    _, query_indices = expand_segments(
+        segments['query_starts'][matched], segments['lengths'][matched]
+    )
+    read_index = segments['read_index'][matched][segment_index]
+    return read_index, reference_positions, query_indices
+
+
+def batch_deletions(batch, segments=None):
+    if segments is None:
+        segments = cigar_segments(batch)
+    deleted = segments['operations'] == DELETION
+    segment_index, reference_positions = expand_segments(
+        segments['reference_starts'][deleted], segments['lengths'][deleted]
+    )
+    return segments['read_index'][deleted][segment_index], reference_positions
+
+
+def batch_count_data(batch, reference_length, start=0):
+    segments = cigar_segments(batch)
+    _, match_positions, query_indices = batch_aligned_pairs(batch, segments)
+    match_codes = base_codes[batch['sequence'][query_indices]]
+    _, deletion_positions = batch_deletions(batch, segments)
+    positions = np.concatenate([match_positions, deletion_positions])
+    codes = np.concatenate([
+        match_codes,
+        np.full(len(deletion_positions), DELETION_CODE, dtype=np.uint8)
+    ])
+    keep = (codes < NUMBER_OF_CODES) & (positions < reference_length) \
+        & (positions >= start)
+    sites = positions[keep] - start
+    number_of_sites = sites.max() + 1 if len(sites) > 0 else 0
+    return np.bincount(
+        sites * NUMBER_OF_CODES + codes[keep],
+        minlength=number_of_sites * NUMBER_OF_CODES
+    ).reshape(number_of_sites, NUMBER_OF_CODES)
+
+
+def add_counts(counts, more_counts):
+    if len(more_counts) > len(counts):
+        counts, more_counts = more_counts, counts
+    counts[:len(more_counts)] += more_counts
+    return counts
+
+
+def window_pileup_counts(reads, reference_length, start=0, batch_size=20000):
+    counts = np.zeros((0, NUMBER_OF_CODES), dtype=np.int64)
+    for batch in read_batches(reads, batch_size):
+        counts = add_counts(
+            counts, batch_count_data(batch, reference_length, start)
+        )
+    return counts
+
+
+def pileup_counts(reads, reference_length, batch_size=20000):
+    counts = np.zeros((reference_length, NUMBER_OF_CODES), dtype=np.int64)
+    return add_counts(
+        counts, window_pileup_counts(reads, reference_length, 0, batch_size)
+    )
+
+
+def reference_windows(reference_length, window_size):
+    return [
+        (start, min(start + window_size, reference_length))
+        for start in range(0, reference_length, window_size)
+    ]
+
+
+def window_count_data(arguments):
+    import pysam
+
+    bam_path, contig, start, stop, reference_length, batch_size = arguments
+    alignment = pysam.AlignmentFile(bam_path, 'rb')
+    # Reads are attributed to the window that holds their first aligned
+    # position, so reads spanning a window edge are only counted once.
+    reads = (
+        read for read in alignment.fetch(contig, start, stop)
+        if read.reference_start >= start
+    )
+    counts = window_pileup_counts(reads, reference_length, start, batch_size)
+    alignment.close()
+    return start, counts
+
+
+def parallel_pileup_counts(
+        bam_path, processes, window_size=1000, batch_size=20000
+        ):
+    import pysam
+
+    alignment = pysam.AlignmentFile(bam_path, 'rb')
+    contig = alignment.references[0]
+    reference_length = alignment.lengths[0]
+    alignment.close()
+    arguments = [
+        (bam_path, contig, start, stop, reference_length, batch_size)
+        for start, stop in reference_windows(reference_length, window_size)
+    ]
+    counts = np.zeros((reference_length, NUMBER_OF_CODES), dtype=np.int64)
+    with Pool(processes) as pool:
+        for start, window_counts in pool.imap_unordered(
+                window_count_data, arguments
+                ):
+            counts[start: start + len(window_counts)] += window_counts
+    return counts
@@ -0,0 +1,116 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+
+PILEUP_CACHE_ENVIRONMENT_VARIABLE = 'ACME_PILEUP_CACHE'
+PILEUP_CACHE_BYTES_ENVIRONMENT_VARIABLE = 'ACME_PILEUP_CACHE_BYTES'
+DEFAULT_PILEUP_CACHE_BYTES = 2**30
+
+
+def pileup_cache_directory():
+    # Caching is opt-in: without a directory, counts are always computed.
+    return os.environ.get(PILEUP_CACHE_ENVIRONMENT_VARIABLE) or None
+
+
+def pileup_cache_bytes():
+    return int(os.environ.get(
+        PILEUP_CACHE_BYTES_ENVIRONMENT_VARIABLE, DEFAULT_PILEUP_CACHE_BYTES
+    ))
+
+
+def bam_index_path(bam_path):
+    candidates = [
+        bam_path + '.bai', bam_path + '.csi',
+        os.path.splitext(bam_path)[0] + '.bai'
+    ]
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def file_checksum(path, block_size=2**20):
+    checksum = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as checksum_file:
+        for block in iter(lambda: checksum_file.read(block_size), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def bam_fingerprint(bam_path):
+    # The index is small but changes whenever the BAM's reads do, so its
+    # checksum stands in for hashing the whole BAM.
+    index_path = bam_index_path(bam_path)
+    if index_path is None:
+        return None
+    bam_stat = os.stat(bam_path)
+    return '%d-%d-%s' % (
+        bam_stat.st_size, bam_stat.st_mtime_ns, file_checksum(index_path)
+    )
+
+
+def evict_pileup_cache(cache_directory, max_bytes):
+    # Least recently used first; hits refresh a file's mtime.
+    entries = []
+    for name in os.listdir(cache_directory):
+        if not name.endswith('.npy'):
+            continue
+        path = os.path.join(cache_directory, name)
+        # Another job may evict the same entries concurrently.
+        try:
+            entry_stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((entry_stat.st_mtime_ns, entry_stat.st_size, path))
+    entries.sort()
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
+
+
+def cached_pileup_counts(
+        bam_path, compute, cache_directory=None, max_bytes=None
+        ):
+    cache_directory = cache_directory or pileup_cache_directory()
+    if cache_directory is None:
+        return compute()
+    fingerprint = bam_fingerprint(bam_path)
+    if fingerprint is None:
+        return compute()
+    max_bytes = pileup_cache_bytes() if max_bytes is None else max_bytes
+    cache_path = os.path.join(cache_directory, fingerprint + '.npy')
+    # Another job may evict the entry at any point, in which case the
+    # counts are computed again, or loaded but not marked as used.
+    try:
+        counts = np.load(cache_path)
+    except FileNotFoundError:
+        counts = None
+    if counts is not None:
+        try:
+            os.utime(cache_path)
+        except FileNotFoundError:
+            pass
+        return counts
+    counts = compute()
+    if counts.max(initial=0) > np.iinfo(np.uint32).max:
+        return counts
+    os.makedirs(cache_directory, exist_ok=True)
+    # Written under a temporary name so concurrent jobs never read a
+    # partial file.
+    descriptor, temporary_path = tempfile.mkstemp(
+        suffix='.tmp', dir=cache_directory
+    )
+    with os.fdopen(descriptor, 'wb') as cache_file:
+        np.save(cache_file, counts.astype(np.uint32))
+    os.replace(temporary_path, cache_path)
+    evict_pileup_cache(cache_directory, max_bytes)
+    return counts
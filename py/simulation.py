@@ -1,74 +1,168 @@
 import csv
 import json
-from itertools import tee
+import os
+import tempfile
 
 import numpy as np
-from Bio import SeqIO
-import pysam
-import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
+
+from .superread_store import load_superread_columns
+from .codec import A, C, G, T, GAP, encode_sequence, encode_records, fasta_matrix
+from .distance import hamming_distances
+from .pileup import aligns_bases, cigar_segments, expand_segments
+from .pileup import batch_aligned_pairs
+from .vacs import read_offsets
 
 
 def extract_lanl_genome(lanl_input, lanl_id, fasta_output):
+  from Bio import SeqIO
+
   records = SeqIO.to_dict(SeqIO.parse(lanl_input, 'fasta'))
   record = records[lanl_id]
   SeqIO.write(record, fasta_output, 'fasta')
 
 
-def simulate_amplicon_dataset(dataset, gene, output_fastq, output_fasta):
-  simulated_reads = []
+FASTQ_INDEX_EXTENSION = '.index.json'
+FASTQ_INDEX_STRIDE = 4096
+COPY_BLOCK_SIZE = 2**20
+
+
+def build_fastq_index(fastq_path):
+  # Records are assumed to be four lines long, as written by ART and SeqIO.
+  offsets = []
+  number_of_reads = 0
+  with open(fastq_path, 'rb') as fastq_file:
+    offset = 0
+    for i, line in enumerate(fastq_file):
+      if i % 4 == 0:
+        if not line.startswith(b'@'):
+          raise ValueError(
+            '%s is not a four line FASTQ at byte %d' % (fastq_path, offset)
+          )
+        if number_of_reads % FASTQ_INDEX_STRIDE == 0:
+          offsets.append(offset)
+        number_of_reads += 1
+      offset += len(line)
+  return {
+    'number_of_reads': number_of_reads,
+    'stride': FASTQ_INDEX_STRIDE,
+    'offsets': offsets
+  }
+
+
+def fastq_index(fastq_path):
+  # Jobs simulating the same strain share this index, so it is replaced
+  # atomically, and anything unreadable is treated as stale and rebuilt.
+  index_path = fastq_path + FASTQ_INDEX_EXTENSION
+  fastq_stat = os.stat(fastq_path)
+  try:
+    with open(index_path) as index_file:
+      index = json.load(index_file)
+    if index['size'] == fastq_stat.st_size and \
+        index['mtime_ns'] == fastq_stat.st_mtime_ns:
+      return index
+  except (FileNotFoundError, ValueError, KeyError):
+    pass
+  index = build_fastq_index(fastq_path)
+  index['size'] = fastq_stat.st_size
+  index['mtime_ns'] = fastq_stat.st_mtime_ns
+  descriptor, temporary_path = tempfile.mkstemp(
+    suffix='.tmp', dir=os.path.dirname(os.path.abspath(index_path))
+  )
+  with os.fdopen(descriptor, 'w') as index_file:
+    json.dump(index, index_file)
+  os.replace(temporary_path, index_path)
+  return index
+
+
+def fastq_prefix_end(fastq_file, index, number_of_reads):
+  if number_of_reads >= index['number_of_reads']:
+    return index['size']
+  checkpoint, remainder = divmod(number_of_reads, index['stride'])
+  fastq_file.seek(index['offsets'][checkpoint])
+  for i in range(4*remainder):
+    fastq_file.readline()
+  return fastq_file.tell()
+
+
+def copy_fastq_prefix(fastq_path, output_file, number_of_reads):
+  index = fastq_index(fastq_path)
+  with open(fastq_path, 'rb') as fastq_file:
+    remaining = fastq_prefix_end(fastq_file, index, number_of_reads)
+    fastq_file.seek(0)
+    block = b''
+    while remaining > 0:
+      block = fastq_file.read(min(COPY_BLOCK_SIZE, remaining))
+      if not block:
+        break
+      output_file.write(block)
+      remaining -= len(block)
+    # The last record of a file may lack its newline; the next strain's
+    # reads would otherwise run into it.
+    if block and not block.endswith(b'\n'):
+      output_file.write(b'\n')
+
+
+def simulate_amplicon_dataset(
+    dataset, gene, output_fastq, output_fasta, output_json=None
+    ):
+  from Bio import SeqIO
+
   true_genes = []
+  lanl_ids = []
+  strain_counts = []
   with open('simulations.json') as json_file:
     simulation_information = json.load(json_file)[dataset]
-  for lanl_information in simulation_information:
-    lanl_id = lanl_information['lanl_id']
-    lanl_reads_filename = "output/lanl/%s/%s/reads.fastq" % (lanl_id, gene)
-    lanl_reads = list(SeqIO.parse(lanl_reads_filename, 'fastq'))
-    current_frequency = lanl_information['frequency']
-    number_of_reads_to_extract = int(current_frequency * len(lanl_reads))
-    simulated_reads.extend(lanl_reads[:number_of_reads_to_extract])
-
-    lanl_gene_filename = "output/lanl/%s/%s/sequence.fasta" % (lanl_id, gene)
-    lanl_gene = SeqIO.read(lanl_gene_filename, 'fasta')
-    true_genes.append(lanl_gene)
-  SeqIO.write(simulated_reads, output_fastq, 'fastq')
+  with open(output_fastq, 'wb') as output_file:
+    for lanl_information in simulation_information:
+      lanl_id = lanl_information['lanl_id']
+      lanl_reads_filename = "output/lanl/%s/%s/reads.fastq" % (lanl_id, gene)
+      number_of_lanl_reads = fastq_index(lanl_reads_filename)['number_of_reads']
+      current_frequency = lanl_information['frequency']
+      number_of_reads_to_extract = int(current_frequency * number_of_lanl_reads)
+      copy_fastq_prefix(
+        lanl_reads_filename, output_file, number_of_reads_to_extract
+      )
+      lanl_ids.append(lanl_id)
+      strain_counts.append(number_of_reads_to_extract)
+
+      lanl_gene_filename = "output/lanl/%s/%s/sequence.fasta" % (lanl_id, gene)
+      lanl_gene = SeqIO.read(lanl_gene_filename, 'fasta')
+      true_genes.append(lanl_gene)
   SeqIO.write(true_genes, output_fasta, 'fasta')
 
+  tally = read_tally(lanl_ids)
+  tally['total_reads'] = sum(strain_counts)
+  tally['strain_counts'] = strain_counts
+  if output_json:
+    with open(output_json, 'w') as json_file:
+      json.dump(tally_statistics(tally), json_file, indent=2)
+  return tally
+
 
 def create_numeric_fasta(records):
-    for_numeric, for_headers = tee(records, 2)
-    mr = MappedReads()
-    np_arrays = [
-        mr.get_numeric_representation(record)
-        for record in for_numeric
-    ]
-    numeric = np.vstack(np_arrays)
-    headers = [record.id for record in for_headers]
-    return headers, numeric
+    return encode_records(records)
+
+def evaluate(input_haplotypes, input_truth, output_json, threads=1):
+    from Bio import SeqIO
 
-def evaluate(input_haplotypes, input_truth, output_json):
     haplotypes = SeqIO.parse(input_haplotypes, 'fasta')
     truth = SeqIO.parse(input_truth, 'fasta')
     haplotype_index, numeric_haplotypes = create_numeric_fasta(haplotypes)
     truth_index, numeric_truth = create_numeric_fasta(truth)
     full_numeric = np.vstack([numeric_truth, numeric_haplotypes])
     counts = np.array([
-        np.sum(full_numeric == 15, axis=0),
-        np.sum(full_numeric == 0, axis=0),
-        np.sum(full_numeric == 1, axis=0),
-        np.sum(full_numeric == 2, axis=0),
-        np.sum(full_numeric == 3, axis=0)
+        np.sum(full_numeric == GAP, axis=0),
+        np.sum(full_numeric == A, axis=0),
+        np.sum(full_numeric == C, axis=0),
+        np.sum(full_numeric == G, axis=0),
+        np.sum(full_numeric == T, axis=0)
     ])
     discordant = np.sum(counts == 0, axis=0) != 4
     get_headers_as_strings = lambda index: [str(header) for header in index]
     headers = get_headers_as_strings(truth_index)+get_headers_as_strings(haplotype_index)
-    n_headers = len(headers)
-    discordance_matrix = [n_headers*[0] for i in range(n_headers)]
-    for i in range(n_headers):
-        for j in range(n_headers):
-            discordance = np.sum(full_numeric[i,:] != full_numeric[j,:])
-            discordance_matrix[i][j] = int(discordance)
+    discordance_matrix = hamming_distances(
+        full_numeric, threads=int(threads)
+    ).tolist()
     output = {
         'number_of_discordant_sites': int(np.sum(discordant)),
         'headers': headers,
@@ -79,85 +173,246 @@ def evaluate(input_haplotypes, input_truth, output_json):
 
 
 def covarying_sites(input_fasta, output_json):
-    fasta_np = np.array([
-        list(str(record.seq)) for record in SeqIO.parse(input_fasta, 'fasta')
-    ], dtype='<U1')
-    A_sum = np.sum(fasta_np == 'A', axis=0)
-    C_sum = np.sum(fasta_np == 'C', axis=0)
-    G_sum = np.sum(fasta_np == 'G', axis=0)
-    T_sum = np.sum(fasta_np == 'T', axis=0)
+    _, fasta_np = fasta_matrix(input_fasta)
+    A_sum = np.sum(fasta_np == A, axis=0)
+    C_sum = np.sum(fasta_np == C, axis=0)
+    G_sum = np.sum(fasta_np == G, axis=0)
+    T_sum = np.sum(fasta_np == T, axis=0)
     max_count = np.max(np.vstack([A_sum, C_sum, G_sum, T_sum]), axis=0)
     covarying_sites = np.arange(fasta_np.shape[1])[max_count < fasta_np.shape[0]]
     with open(output_json, 'w') as json_file:
         json.dump([int(cvs) for cvs in covarying_sites], json_file)
 
 
-def get_sam_info(sam):
-    sam_info = {}
-    for i, read in enumerate(sam):
-        location = (read.reference_start, read.reference_end)
-        if location in sam_info:
-            sam_info[location].append(i)
-        else:
-            sam_info[location] = [i]
-    return sam_info
+LOCATION_KEY = 2**32
+FASTQ_BLOCK_SIZE = 10000
+
+
+def strain_reads(sam_path):
+    import pysam
+
+    query_names = []
+    reference_starts = []
+    reference_ends = []
+    operation_counts = []
+    cigars = []
+    queries = []
+    qualities = []
+    for read in pysam.AlignmentFile(sam_path, 'r'):
+        cigar = read.cigartuples or []
+        query_names.append(read.query_name)
+        reference_starts.append(read.reference_start)
+        reference_ends.append(
+            -1 if read.reference_end is None else read.reference_end
+        )
+        operation_counts.append(len(cigar))
+        cigars.extend(cigar)
+        queries.append(read.query or '')
+        qualities.append(read.qual or '')
+    cigars = np.array(cigars, dtype=np.int64).reshape(-1, 2)
+    reads = {
+        'query_names': query_names,
+        'reference_starts': np.array(reference_starts, dtype=np.int64),
+        'reference_ends': np.array(reference_ends, dtype=np.int64),
+        'operation_counts': np.array(operation_counts, dtype=np.int64),
+        'operations': cigars[:, 0],
+        'lengths': cigars[:, 1],
+        'sequence': np.frombuffer(''.join(queries).encode('ascii'), dtype=np.uint8),
+        'quality': np.frombuffer(''.join(qualities).encode('ascii'), dtype=np.uint8)
+    }
+    for name, strings in (('sequence', queries), ('quality', qualities)):
+        lengths = np.array([len(string) for string in strings], dtype=np.int64)
+        reads[name + '_offsets'] = np.cumsum(lengths) - lengths
+        reads[name + '_lengths'] = lengths
+    reads['operation_offsets'] = np.cumsum(reads['operation_counts']) \
+        - reads['operation_counts']
+    segments = cigar_segments(reads)
+    matched = aligns_bases[segments['operations']] & (segments['lengths'] > 0)
+    read_index = segments['read_index'][matched]
+    segment_starts = segments['reference_starts'][matched]
+    segment_ends = segment_starts + segments['lengths'][matched] - 1
+    reads['first_aligned'] = np.full(len(query_names), -1, dtype=np.int64)
+    reads['last_aligned'] = np.full(len(query_names), -1, dtype=np.int64)
+    aligned_reads, first_segments = np.unique(read_index, return_index=True)
+    reads['first_aligned'][aligned_reads] = segment_starts[first_segments]
+    last_segments = np.append(first_segments[1:], len(read_index)) - 1
+    reads['last_aligned'][aligned_reads] = segment_ends[last_segments]
+
+    keys = reads['reference_starts'] * LOCATION_KEY + reads['reference_ends']
+    reads['location_order'] = np.argsort(keys, kind='mergesort')
+    reads['location_keys'], reads['location_firsts'], reads['location_counts'] = \
+        np.unique(keys[reads['location_order']], return_index=True, return_counts=True)
+    return reads
 
 
 def get_reference_to_alignment_map(lanl_id, aligned_genomes):
-    fasta_np = np.array(list(aligned_genomes[lanl_id].seq), dtype='<U1')
-    indices = np.arange(len(fasta_np))[fasta_np != '-']
+    fasta_np = encode_sequence(aligned_genomes[lanl_id].seq)
+    indices = np.arange(len(fasta_np))[fasta_np != GAP]
     return indices
 
 
 def get_alignment_to_reference_map(lanl_id, aligned_genomes):
-    fasta_np = np.array(list(aligned_genomes[lanl_id].seq), dtype='<U1')
-    indices = np.cumsum(fasta_np != '-') - 1
+    fasta_np = encode_sequence(aligned_genomes[lanl_id].seq)
+    indices = np.cumsum(fasta_np != GAP) - 1
     return indices
 
 
+def spiral_shifts(stop=25):
+    shifts = []
+    for i in range(stop):
+        for j in range(i+1):
+            shifts.extend([(j, i-j), (j, j-i), (-j, i-j), (-j, j-i)])
+    return np.array(shifts, dtype=np.int64)
+
+
+def find_location(
+        left_alignment_start, left_alignment_end, location_keys,
+        right_a2r_map, shifts
+        ):
+    alignment_length = len(right_a2r_map)
+    right_alignment_starts = left_alignment_start + shifts[:, 0]
+    right_alignment_ends = left_alignment_end + shifts[:, 1]
+    valid = (right_alignment_starts >= 0) \
+        & (right_alignment_starts < alignment_length) \
+        & (right_alignment_ends < alignment_length) \
+        & (right_alignment_ends >= -alignment_length)
+    keys = right_a2r_map[right_alignment_starts[valid]] * LOCATION_KEY \
+        + right_a2r_map[right_alignment_ends[valid]]
+    locations = np.searchsorted(location_keys, keys)
+    found = locations < len(location_keys)
+    found[found] = location_keys[locations[found]] == keys[found]
+    if not found.any():
+        return None
+    return locations[found.argmax()]
+
+
 def get_mate(
-        read, left_strain, right_strain, sams, sam_infos,
-        r2a_maps, a2r_maps, stop=25
+        left_alignment_start, left_alignment_end, right_reads, right_a2r_map,
+        shifts
         ):
-    sam = sams[right_strain]
-    sam_info = sam_infos[right_strain]
-    i = 0
-    left_alignment_start = r2a_maps[left_strain][read.reference_start]
-    left_alignment_end = r2a_maps[left_strain][read.reference_end-1]
-    while True:
-        for j in range(i+1):
-            all_shifts = [(j, i-j), (j, j-i), (-j, i-j), (-j, j-i)]
-            for left_shift, right_shift in all_shifts:
-                right_alignment_start = left_alignment_start + left_shift
-                right_alignment_end = left_alignment_end + right_shift
- 
-                starts_before = right_alignment_start < 0
-                ends_after = right_alignment_end >= len(a2r_maps[right_strain])
-
-                if starts_before or ends_after:
-                    continue
-
-                right_reference_start = a2r_maps[right_strain][right_alignment_start]
-                right_reference_end = a2r_maps[right_strain][right_alignment_end]
-                location = (right_reference_start, right_reference_end)
-                if location in sam_info:
-                    n = len(sam_info[location])
-                    i = np.random.randint(n)
-                    return sam_info[location][i]
-        i += 1
-        if i == stop:
-            return None
+    # Probe right-strain locations in order of increasing shift, in growing
+    # chunks, and take a random read at the first location that exists.
+    first = 0
+    chunk_size = 16
+    while first < len(shifts):
+        last = min(first + chunk_size, len(shifts))
+        location = find_location(
+            left_alignment_start, left_alignment_end,
+            right_reads['location_keys'], right_a2r_map, shifts[first: last]
+        )
+        if location is not None:
+            i = np.random.randint(right_reads['location_counts'][location])
+            return right_reads['location_order'][
+                right_reads['location_firsts'][location] + i
+            ]
+        first = last
+        chunk_size *= 4
+    return None
+
+
+def read_subset(reads, read_indices):
+    operation_counts = reads['operation_counts'][read_indices]
+    _, operation_indices = expand_segments(
+        reads['operation_offsets'][read_indices], operation_counts
+    )
+    return {
+        'reference_starts': reads['reference_starts'][read_indices],
+        'operation_counts': operation_counts,
+        'operations': reads['operations'][operation_indices],
+        'lengths': reads['lengths'][operation_indices],
+        'sequence_offsets': reads['sequence_offsets'][read_indices]
+    }
+
+
+def recombinant_parts(reads, read_indices, cuts, left):
+    subset = read_subset(reads, read_indices)
+    read_index, reference_positions, query_indices = batch_aligned_pairs(subset)
+    if left:
+        keep = reference_positions < cuts[read_index]
+    else:
+        keep = reference_positions >= cuts[read_index]
+    read_index = read_index[keep]
+    query_indices = query_indices[keep]
+    query_positions = query_indices - subset['sequence_offsets'][read_index]
+    quality_indices = reads['quality_offsets'][read_indices][read_index] \
+        + query_positions
+    offsets = read_offsets(read_index, len(read_indices))
+    sequence = reads['sequence'][query_indices].tobytes().decode('ascii')
+    quality = reads['quality'][quality_indices].tobytes().decode('ascii')
+    return [
+        (sequence[offsets[i]: offsets[i+1]], quality[offsets[i]: offsets[i+1]])
+        for i in range(len(read_indices))
+    ]
+
+
+def strain_parts(all_reads, strains, read_indices, cuts, left):
+    parts = [None] * len(strains)
+    for strain, reads in enumerate(all_reads):
+        current = np.flatnonzero(strains == strain)
+        if len(current) == 0:
+            continue
+        for i, part in zip(current, recombinant_parts(
+                reads, read_indices[current], cuts[current], left
+                )):
+            parts[i] = part
+    return parts
+
+
+def read_string(reads, name, i):
+    offset = reads[name + '_offsets'][i]
+    length = reads[name + '_lengths'][i]
+    return reads[name][offset: offset + length].tobytes().decode('ascii')
+
+
+def read_tally(lanl_ids):
+    return {
+        'lanl_ids': lanl_ids,
+        'total_reads': 0,
+        'recombined_reads': 0,
+        'strain_counts': [0 for i in lanl_ids]
+    }
+
+
+def tally_read(tally, read_id):
+    tally['total_reads'] += 1
+    if '+' in read_id:
+        tally['recombined_reads'] += 1
+    else:
+        for i, lanl_id in enumerate(tally['lanl_ids']):
+            if lanl_id in read_id:
+                tally['strain_counts'][i] += 1
+
+
+def tally_statistics(tally):
+    info = {}
+    non_recombined_reads = sum(tally['strain_counts'])
+    info['totalReads'] = tally['total_reads']
+    info['recombination'] = tally['recombined_reads'] / tally['total_reads']
+    for i, lanl_id in enumerate(tally['lanl_ids']):
+        info[lanl_id] = tally['strain_counts'][i]/non_recombined_reads
+    return info
+
+
+def write_fastq_blocks(output_file, records, tally=None):
+    block = []
+    for header, sequence, quality in records:
+        block.append('@%s\n%s\n+\n%s\n' % (header, sequence, quality))
+        if tally is not None:
+            tally_read(tally, header)
+        if len(block) == FASTQ_BLOCK_SIZE:
+            output_file.write(''.join(block))
+            block = []
+    output_file.write(''.join(block))
 
 
 def write_ar_dataset(
         lanl_ids, frequencies, ar, aligned_genomes, output_fastq,
         number_of_reads
         ):
-    sams = [
-        list(pysam.AlignmentFile('output/lanl/%s/wgs.sam' % lanl_id, "r"))
+    all_reads = [
+        strain_reads('output/lanl/%s/wgs.sam' % lanl_id)
         for lanl_id in lanl_ids
     ]
-    sam_infos = [get_sam_info(sam) for sam in sams]
     number_of_ar_reads = np.ceil(ar*number_of_reads).astype(np.int)
     number_of_clean_reads = number_of_reads - number_of_ar_reads
     number_of_strains = len(frequencies)
@@ -188,86 +443,99 @@ def write_ar_dataset(
         get_alignment_to_reference_map(lanl_id, aligned_genomes)
         for lanl_id in lanl_ids
     ]
-    with open(output_fastq, 'w') as output_file:
-        i = 0
-        for _ in range(number_of_ar_reads):
-            found = False
-            while not found:
-                left_strain = ar_left_strains[i]
-                left_read_index = ar_left_indices[i]
-                left_read = sams[left_strain][left_read_index]
-                right_strain = ar_right_strains[i]
-                right_read_index = get_mate(
-                    left_read, left_strain, right_strain, sams, sam_infos,
-                    reference_to_alignment_maps, alignment_to_reference_maps
-                )
-                i += 1
-                if right_read_index is not None:
-                    found = True
-            right_read = sams[right_strain][right_read_index]
-
-            left_aligned_pairs = left_read.get_aligned_pairs(matches_only=True)
-            right_aligned_pairs = right_read.get_aligned_pairs(matches_only=True)
-            left_a2r_map = alignment_to_reference_maps[left_strain]
+    shifts = spiral_shifts()
+    left_strains = np.zeros(number_of_ar_reads, dtype=np.int64)
+    left_indices = np.zeros(number_of_ar_reads, dtype=np.int64)
+    right_strains = np.zeros(number_of_ar_reads, dtype=np.int64)
+    right_indices = np.zeros(number_of_ar_reads, dtype=np.int64)
+    recombination_sites = np.zeros(number_of_ar_reads, dtype=np.int64)
+    i = 0
+    for k in range(number_of_ar_reads):
+        found = False
+        while not found:
+            left_strain = ar_left_strains[i]
+            left_read_index = ar_left_indices[i]
+            left_reads = all_reads[left_strain]
             left_r2a_map = reference_to_alignment_maps[left_strain]
-            right_a2r_map = alignment_to_reference_maps[right_strain]
-            right_r2a_map = reference_to_alignment_maps[right_strain]
-
-            recombination_lower = np.max([
-                left_r2a_map[left_aligned_pairs[0][1]],
-                right_r2a_map[right_aligned_pairs[0][1]]
-            ])
-            recombination_upper = np.min([
-                left_r2a_map[left_aligned_pairs[-1][1]],
-                right_r2a_map[right_aligned_pairs[-1][1]]
-            ])
-            recombination_site = np.random.randint(
-                recombination_lower, recombination_upper
+            right_strain = ar_right_strains[i]
+            right_read_index = get_mate(
+                left_r2a_map[left_reads['reference_starts'][left_read_index]],
+                left_r2a_map[left_reads['reference_ends'][left_read_index]-1],
+                all_reads[right_strain],
+                alignment_to_reference_maps[right_strain],
+                shifts
             )
-
-            header = '@' + left_read.query_name + '+' + right_read.query_name + '\n'
-            output_file.write(header)
-            left_query = ''.join([
-                left_read.query[pair[0]]
-                for pair in left_aligned_pairs
-                if pair[1] < left_a2r_map[recombination_site]
-            ])
-            right_query = ''.join([
-                right_read.query[pair[0]]
-                for pair in right_aligned_pairs
-                if pair[1] >= right_a2r_map[recombination_site]
-            ])
-            query = left_query + right_query
-            output_file.write(query + '\n')
-            output_file.write('+\n')
-            left_quality = ''.join([
-                left_read.qual[pair[0]]
-                for pair in left_aligned_pairs
-                if pair[1] < left_a2r_map[recombination_site]
-            ])
-            right_quality = ''.join([
-                right_read.qual[pair[0]]
-                for pair in right_aligned_pairs
-                if pair[1] >= right_a2r_map[recombination_site]
-            ])
-            quality = left_quality + right_quality
-            output_file.write(quality + '\n')
-
-        nonrecombined_strains = np.random.choice(
-            number_of_strains, number_of_clean_reads, p=frequencies
-        )
-        nonrecombined_indices = np.random.choice(
-            number_of_reads, number_of_clean_reads, replace=False
+            i += 1
+            if right_read_index is not None:
+                found = True
+        right_reads = all_reads[right_strain]
+        right_r2a_map = reference_to_alignment_maps[right_strain]
+
+        recombination_lower = np.max([
+            left_r2a_map[left_reads['first_aligned'][left_read_index]],
+            right_r2a_map[right_reads['first_aligned'][right_read_index]]
+        ])
+        recombination_upper = np.min([
+            left_r2a_map[left_reads['last_aligned'][left_read_index]],
+            right_r2a_map[right_reads['last_aligned'][right_read_index]]
+        ])
+        left_strains[k] = left_strain
+        left_indices[k] = left_read_index
+        right_strains[k] = right_strain
+        right_indices[k] = right_read_index
+        recombination_sites[k] = np.random.randint(
+            recombination_lower, recombination_upper
         )
-        for strain, index in zip(nonrecombined_strains, nonrecombined_indices):
-            read = sams[strain][index]
-            output_file.write('@' + read.query_name + '\n')
-            output_file.write(read.query + '\n')
-            output_file.write('+\n')
-            output_file.write(read.qual + '\n')
+
+    left_cuts = np.zeros(number_of_ar_reads, dtype=np.int64)
+    right_cuts = np.zeros(number_of_ar_reads, dtype=np.int64)
+    for strain, a2r_map in enumerate(alignment_to_reference_maps):
+        left_cuts[left_strains == strain] = \
+            a2r_map[recombination_sites[left_strains == strain]]
+        right_cuts[right_strains == strain] = \
+            a2r_map[recombination_sites[right_strains == strain]]
+    left_parts = strain_parts(
+        all_reads, left_strains, left_indices, left_cuts, True
+    )
+    right_parts = strain_parts(
+        all_reads, right_strains, right_indices, right_cuts, False
+    )
+
+    nonrecombined_strains = np.random.choice(
+        number_of_strains, number_of_clean_reads, p=frequencies
+    )
+    nonrecombined_indices = np.random.choice(
+        number_of_reads, number_of_clean_reads, replace=False
+    )
+    tally = read_tally(lanl_ids)
+    with open(output_fastq, 'w') as output_file:
+        write_fastq_blocks(output_file, (
+            (
+                all_reads[left_strain]['query_names'][left_index] + '+'
+                + all_reads[right_strain]['query_names'][right_index],
+                left_part[0] + right_part[0],
+                left_part[1] + right_part[1]
+            )
+            for left_strain, left_index, right_strain, right_index,
+            left_part, right_part in zip(
+                left_strains, left_indices, right_strains, right_indices,
+                left_parts, right_parts
+            )
+        ), tally)
+        write_fastq_blocks(output_file, (
+            (
+                all_reads[strain]['query_names'][index],
+                read_string(all_reads[strain], 'sequence', index),
+                read_string(all_reads[strain], 'quality', index)
+            )
+            for strain, index in zip(nonrecombined_strains, nonrecombined_indices)
+        ), tally)
+    return tally
 
 
 def simulation_truth(dataset, output_fasta):
+    from Bio import SeqIO
+
     with open('simulations.json') as json_file:
         simulation_information = json.load(json_file)[dataset]
     lanl_ids = [lanl_info['lanl_id'] for lanl_info in simulation_information]
@@ -283,6 +551,8 @@ def simulate_wgs_dataset(
         dataset, ar, input_fasta, output_fastq, output_json,
         seed=1, number_of_reads=300000
         ):
+    from Bio import SeqIO
+
     np.random.seed(int(seed))
     ar = float(ar)/100
     with open('simulations.json') as json_file:
@@ -294,39 +564,29 @@ def simulate_wgs_dataset(
     aligned_genomes = SeqIO.to_dict(
         SeqIO.parse(input_fasta, 'fasta')
     )
-    write_ar_dataset(
+    tally = write_ar_dataset(
         lanl_ids, frequencies, ar, aligned_genomes, output_fastq,
         number_of_reads
         )
 
     with open(output_json, 'w') as json_file:
-        json.dump(
-            evaluate_simulated_ar(lanl_ids, output_fastq), json_file, indent=2
-        )
+        json.dump(tally_statistics(tally), json_file, indent=2)
 
 
 def evaluate_simulated_ar(lanl_ids, filename):
-    ar_dataset = list(SeqIO.parse(filename, 'fastq'))
-    recombined_reads = 0
-    strain_counts = [0 for i in lanl_ids]
-    total_reads = len(ar_dataset)
-    info = {}
-    for read in ar_dataset:
-        if '+' in read.id:
-            recombined_reads += 1
-        else:
-            for i, lanl_id in enumerate(lanl_ids):
-                if lanl_id in read.id:
-                    strain_counts[i] += 1
-    non_recombined_reads = sum(strain_counts)
-    info['totalReads'] = total_reads
-    info['recombination'] = recombined_reads / total_reads
-    for i, lanl_id in enumerate(lanl_ids):
-        info[lanl_id] = strain_counts[i]/non_recombined_reads
-    return info
+    from Bio import SeqIO
+
+    tally = read_tally(lanl_ids)
+    for read in SeqIO.parse(filename, 'fastq'):
+        tally_read(tally, read.id)
+    return tally_statistics(tally)
 
 
 def n_paths_boxplot(simulated_dataset, gene, output_filepath):
+    import pandas as pd
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     template_string = "output/sim-%s_ar-%d_seed-%d/fastp/bowtie2/%s/acme/graph.json"
     input_files = []
     data_seeds = []
@@ -353,18 +613,16 @@ def n_paths_boxplot(simulated_dataset, gene, output_filepath):
 
 
 def superread_weight_distribution_data(superreads_filepath, csv_filepath):
-    with open(superreads_filepath) as json_file:
-        superreads = json.load(json_file)
+    superreads = load_superread_columns(superreads_filepath)
+    offsets = superreads['composition_offsets']
+    counts = superreads['composition_counts']
     csv_file = open(csv_filepath, 'w')
     csv_writer = csv.DictWriter(csv_file, fieldnames=['weight', 'composition'])
     csv_writer.writeheader()
-    for superread in superreads:
-        composition = max(
-            superread['composition'].items(),
-            key=lambda i: i[1]
-        )[0]
+    for i in range(superreads['number_of_superreads']):
+        dominant = offsets[i] + counts[offsets[i]: offsets[i+1]].argmax()
         csv_writer.writerow({
-            'weight': superread['weight'],
-            'composition': composition
+            'weight': superreads['weight'][i],
+            'composition': superreads['labels'][superreads['composition_labels'][dominant]]
         })
     csv_file.close()
@@ -0,0 +1,264 @@
+import json
+import os
+
+import numpy as np
+
+from .acme import all_read_count_data, count_table, threshold_sites
+from .acme import group_superreads, fold_reads, superreads_from_groups
+from .instrumentation import stage, profiled
+from .superread_store import write_superreads
+
+
+def merge_read_group(read_groups, boundaries, superreads):
+    if not boundaries in read_groups:
+        read_groups[boundaries] = superreads
+        return
+    group = read_groups[boundaries]
+    for vacs, (weight, ar, composition) in superreads.items():
+        if not vacs in group:
+            group[vacs] = [weight, ar, composition]
+            continue
+        group[vacs][0] += weight
+        group[vacs][1] += ar
+        for label, count in composition.items():
+            group[vacs][2][label] = group[vacs][2].get(label, 0) + count
+
+
+def state_covarying_sites(counts, threshold, end_correction):
+    return threshold_sites(
+        count_table(counts.astype(np.float64)), threshold, end_correction
+    )
+
+
+def initial_superread_state(
+        bam_path, threshold=.01, end_correction=10, processes=1,
+        window_size=1000
+        ):
+    import pysam
+
+    alignment = pysam.AlignmentFile(bam_path, 'rb')
+    with stage('pileup'):
+        counts = all_read_count_data(
+            alignment, processes=processes, window_size=window_size
+        ).astype(np.int64)
+    with stage('thresholding'):
+        covarying_sites = state_covarying_sites(
+            counts, threshold, end_correction
+        )
+    read_groups = group_superreads(alignment, covarying_sites)
+    alignment.close()
+    return {
+        'bam_paths': [os.path.abspath(bam_path)],
+        'threshold': threshold,
+        'end_correction': end_correction,
+        'counts': counts,
+        'covarying_sites': covarying_sites,
+        'read_groups': read_groups
+    }
+
+
+def group_bounds(covarying_sites, covarying_starts, covarying_ends):
+    # A read in group (start, end) begins after site start - 1 and ends
+    # before site end, so it lies strictly inside these bounds.
+    padded = np.concatenate([
+        [-1], covarying_sites, [np.iinfo(np.int64).max]
+    ]).astype(np.int64)
+    return padded[covarying_starts], padded[covarying_ends + 1]
+
+
+def touches_changed_sites(
+        covarying_sites, changed_sites, covarying_starts, covarying_ends
+        ):
+    lower, upper = group_bounds(
+        covarying_sites, covarying_starts, covarying_ends
+    )
+    return np.searchsorted(changed_sites, upper, side='left') \
+        > np.searchsorted(changed_sites, lower, side='right')
+
+
+def rekeyed_boundaries(
+        old_sites, new_sites, covarying_starts, covarying_ends
+        ):
+    # No site changed inside the group's bounds, so its reads still see
+    # the same sites and only their positions in the site list move.
+    padded = np.concatenate([[-1], old_sites]).astype(np.int64)
+    return (
+        np.searchsorted(new_sites, padded[covarying_starts], side='right'),
+        np.searchsorted(new_sites, padded[covarying_ends], side='right')
+    )
+
+
+def affected_reads(bam_path, positions, old_sites, changed_sites):
+    # Reads overlapping several positions are kept at the first of them
+    # only. Of those, only reads whose old group touched a changed site
+    # have to be grouped again.
+    import pysam
+
+    alignment = pysam.AlignmentFile(bam_path, 'rb')
+    contig = alignment.references[0]
+    candidates = []
+    previous_position = -1
+    for position in positions.tolist():
+        for read in alignment.fetch(contig, position, position + 1):
+            if read.reference_start > previous_position:
+                candidates.append(read)
+        previous_position = position
+    alignment.close()
+    starts = np.array([read.reference_start for read in candidates], dtype=np.int64)
+    ends = np.array([read.reference_end for read in candidates], dtype=np.int64)
+    affected = touches_changed_sites(
+        old_sites, changed_sites,
+        np.searchsorted(old_sites, starts), np.searchsorted(old_sites, ends)
+    )
+    return [read for read, keep in zip(candidates, affected) if keep]
+
+
+def update_superread_state(
+        state, bam_path, processes=1, window_size=1000, batch_size=20000
+        ):
+    import pysam
+
+    if os.path.abspath(bam_path) in state['bam_paths']:
+        raise ValueError('%s has already been folded into this state' % bam_path)
+    alignment = pysam.AlignmentFile(bam_path, 'rb')
+    reference_length = alignment.header['SQ'][0]['LN']
+    if reference_length != len(state['counts']):
+        raise ValueError(
+            '%s has reference length %d, state has %d' %
+            (bam_path, reference_length, len(state['counts']))
+        )
+    with stage('pileup'):
+        counts = state['counts'] + all_read_count_data(
+            alignment, processes=processes, window_size=window_size
+        ).astype(np.int64)
+    with stage('thresholding'):
+        new_sites = state_covarying_sites(
+            counts, state['threshold'], state['end_correction']
+        )
+    old_sites = state['covarying_sites']
+    changed_sites = np.setxor1d(old_sites, new_sites)
+    read_groups = state['read_groups']
+    if len(changed_sites) > 0:
+        with stage('rekey') as stage_counts:
+            old_boundaries = list(read_groups)
+            covarying_starts = np.array(
+                [boundaries[0] for boundaries in old_boundaries], dtype=np.int64
+            )
+            covarying_ends = np.array(
+                [boundaries[1] for boundaries in old_boundaries], dtype=np.int64
+            )
+            discarded = touches_changed_sites(
+                old_sites, changed_sites, covarying_starts, covarying_ends
+            )
+            new_starts, new_ends = rekeyed_boundaries(
+                old_sites, new_sites, covarying_starts, covarying_ends
+            )
+            rekeyed_groups = {}
+            for boundaries, discard, start, end in zip(
+                    old_boundaries, discarded, new_starts.tolist(),
+                    new_ends.tolist()
+                    ):
+                if not discard:
+                    merge_read_group(
+                        rekeyed_groups, (start, end), read_groups[boundaries]
+                    )
+            read_groups = rekeyed_groups
+            stage_counts['discarded_groups'] = np.count_nonzero(discarded)
+            stage_counts['rekeyed_groups'] = len(discarded) \
+                - np.count_nonzero(discarded)
+        # Every read of a discarded group covers the group's first site,
+        # and reads that used to cover no site only matter if they cover
+        # a changed one.
+        positions = np.union1d(
+            old_sites[covarying_starts[discarded]], changed_sites
+        )
+        for previous_bam_path in state['bam_paths']:
+            with stage('refetch') as stage_counts:
+                reads = affected_reads(
+                    previous_bam_path, positions, old_sites, changed_sites
+                )
+                stage_counts['reads'] = len(reads)
+            fold_reads(
+                read_groups, reads, new_sites, reference_length, batch_size
+            )
+    fold_reads(
+        read_groups, alignment.fetch(), new_sites, reference_length, batch_size
+    )
+    alignment.close()
+    state.update({
+        'bam_paths': state['bam_paths'] + [os.path.abspath(bam_path)],
+        'counts': counts,
+        'covarying_sites': new_sites,
+        'read_groups': read_groups
+    })
+    return state
+
+
+def state_superreads(state, minimum_weight=3):
+    return superreads_from_groups(state['read_groups'], minimum_weight)
+
+
+def write_superread_state(state, state_path):
+    with open(state_path, 'w') as json_file:
+        json.dump({
+            'bam_paths': state['bam_paths'],
+            'threshold': state['threshold'],
+            'end_correction': state['end_correction'],
+            'counts': state['counts'].tolist(),
+            'covarying_sites': [int(site) for site in state['covarying_sites']],
+            'read_groups': [
+                [int(boundaries[0]), int(boundaries[1]), [
+                    [vacs, weight, ar, composition]
+                    for vacs, (weight, ar, composition) in superreads.items()
+                ]]
+                for boundaries, superreads in state['read_groups'].items()
+            ]
+        }, json_file)
+
+
+def load_superread_state(state_path):
+    with open(state_path) as json_file:
+        state = json.load(json_file)
+    state['counts'] = np.array(state['counts'], dtype=np.int64)
+    state['covarying_sites'] = np.array(state['covarying_sites'], dtype=np.int64)
+    state['read_groups'] = {
+        (covarying_start, covarying_end): {
+            vacs: [weight, ar, composition]
+            for vacs, weight, ar, composition in superreads
+        }
+        for covarying_start, covarying_end, superreads in state['read_groups']
+    }
+    return state
+
+
+def sc_incremental_superread_io(
+        bam_path, state_path, covarying_path, superread_path,
+        minimum_weight=3, threshold=.01, end_correction=10, processes=1,
+        window_size=1000, instrument=None
+        ):
+    with profiled('sc_incremental_superread_io', superread_path, instrument):
+        if os.path.exists(state_path):
+            state = load_superread_state(state_path)
+            if state['threshold'] != float(threshold) or \
+                    state['end_correction'] != int(end_correction):
+                raise ValueError(
+                    '%s was built with threshold %g and end correction %d' %
+                    (state_path, state['threshold'], state['end_correction'])
+                )
+            state = update_superread_state(
+                state, bam_path, int(processes), int(window_size)
+            )
+        else:
+            state = initial_superread_state(
+                bam_path, float(threshold), int(end_correction),
+                int(processes), int(window_size)
+            )
+        write_superread_state(state, state_path)
+        with open(covarying_path, 'w') as json_file:
+            json.dump(
+                [int(site) for site in state['covarying_sites']], json_file
+            )
+        superreads = state_superreads(state, int(minimum_weight))
+        with stage('write') as stage_counts:
+            write_superreads(superreads, superread_path)
+            stage_counts['superreads'] = len(superreads)
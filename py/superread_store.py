@@ -0,0 +1,203 @@
+import json
+import struct
+
+import numpy as np
+
+
+SUPERREAD_STORE_MAGIC = b'ACMESRS1'
+SUPERREAD_STORE_EXTENSION = '.srs'
+ALIGNMENT = 64
+
+
+def vacs_matrix(superreads):
+    lengths = np.array([len(sr['vacs']) for sr in superreads], dtype=np.int64)
+    width = lengths.max() if len(lengths) > 0 else 0
+    matrix = np.zeros((len(superreads), width), dtype=np.uint8)
+    rows = np.repeat(np.arange(len(superreads)), lengths)
+    columns = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    matrix[rows, columns] = np.frombuffer(
+        ''.join([sr['vacs'] for sr in superreads]).encode('ascii'), dtype=np.uint8
+    )
+    return matrix, lengths
+
+
+def superread_columns(superreads):
+    labels = []
+    label_indices = {}
+    composition_labels = []
+    composition_counts = []
+    composition_lengths = []
+    for sr in superreads:
+        for label, count in sr['composition'].items():
+            if not label in label_indices:
+                label_indices[label] = len(labels)
+                labels.append(label)
+            composition_labels.append(label_indices[label])
+            composition_counts.append(count)
+        composition_lengths.append(len(sr['composition']))
+    vacs, vacs_length = vacs_matrix(superreads)
+    return {
+        'labels': labels,
+        'number_of_superreads': len(superreads),
+        'index': np.array([sr['index'] for sr in superreads], dtype=np.int64),
+        'weight': np.array([sr['weight'] for sr in superreads], dtype=np.int64),
+        'frequency': np.array(
+            [sr['frequency'] for sr in superreads], dtype=np.float64
+        ),
+        'ar': np.array([sr['ar'] for sr in superreads], dtype=np.int64),
+        'cv_start': np.array([sr['cv_start'] for sr in superreads], dtype=np.int64),
+        'cv_end': np.array([sr['cv_end'] for sr in superreads], dtype=np.int64),
+        'discarded': np.array(
+            [sr['discarded'] for sr in superreads], dtype=np.bool_
+        ),
+        'vacs': vacs,
+        'vacs_length': vacs_length,
+        'composition_offsets': np.concatenate(
+            [[0], np.cumsum(composition_lengths)]
+        ).astype(np.int64),
+        'composition_labels': np.array(composition_labels, dtype=np.int32),
+        'composition_counts': np.array(composition_counts, dtype=np.int64)
+    }
+
+
+def aligned(number_of_bytes):
+    return -(-number_of_bytes // ALIGNMENT) * ALIGNMENT
+
+
+def write_superread_store(superreads, store_path):
+    columns = superread_columns(superreads)
+    arrays = {
+        name: value for name, value in columns.items()
+        if isinstance(value, np.ndarray)
+    }
+    header = {
+        'number_of_superreads': columns['number_of_superreads'],
+        'labels': columns['labels'],
+        'columns': {}
+    }
+    offset = 0
+    for name, array in arrays.items():
+        header['columns'][name] = {
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+            'offset': offset
+        }
+        offset += aligned(array.nbytes)
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = aligned(len(SUPERREAD_STORE_MAGIC) + 8 + len(header_bytes))
+    with open(store_path, 'wb') as store_file:
+        store_file.write(SUPERREAD_STORE_MAGIC)
+        store_file.write(struct.pack('<Q', len(header_bytes)))
+        store_file.write(header_bytes)
+        for name, array in arrays.items():
+            store_file.seek(data_start + header['columns'][name]['offset'])
+            store_file.write(np.ascontiguousarray(array).tobytes())
+        store_file.truncate(data_start + offset)
+
+
+def is_superread_store(path):
+    with open(path, 'rb') as superread_file:
+        return superread_file.read(len(SUPERREAD_STORE_MAGIC)) == SUPERREAD_STORE_MAGIC
+
+
+def open_superread_store(store_path):
+    with open(store_path, 'rb') as store_file:
+        if store_file.read(len(SUPERREAD_STORE_MAGIC)) != SUPERREAD_STORE_MAGIC:
+            raise ValueError('%s is not a superread store' % store_path)
+        header_length = struct.unpack('<Q', store_file.read(8))[0]
+        header = json.loads(store_file.read(header_length).decode('utf-8'))
+    data_start = aligned(len(SUPERREAD_STORE_MAGIC) + 8 + header_length)
+    store = {
+        'labels': header['labels'],
+        'number_of_superreads': header['number_of_superreads']
+    }
+    for name, column in header['columns'].items():
+        shape = tuple(column['shape'])
+        if np.prod(shape) == 0:
+            store[name] = np.zeros(shape, dtype=column['dtype'])
+            continue
+        store[name] = np.memmap(
+            store_path, dtype=column['dtype'], mode='r',
+            offset=data_start + column['offset'], shape=shape
+        )
+    return store
+
+
+def load_superread_columns(superread_path):
+    if is_superread_store(superread_path):
+        return open_superread_store(superread_path)
+    with open(superread_path) as json_file:
+        return superread_columns(json.load(json_file))
+
+
+def superread_window(columns, min_cv_start, max_cv_end):
+    starts_after = columns['cv_start'] >= min_cv_start
+    ends_before = columns['cv_end'] < max_cv_end
+    return np.flatnonzero(starts_after & ends_before)
+
+
+def column_vacs(columns, i):
+    return columns['vacs'][i, :columns['vacs_length'][i]].tobytes().decode('ascii')
+
+
+def column_composition(columns, i):
+    start = columns['composition_offsets'][i]
+    end = columns['composition_offsets'][i+1]
+    return {
+        columns['labels'][label]: int(count)
+        for label, count in zip(
+            columns['composition_labels'][start: end],
+            columns['composition_counts'][start: end]
+        )
+    }
+
+
+def superreads_from_columns(columns, indices=None):
+    if indices is None:
+        indices = range(columns['number_of_superreads'])
+    superreads = []
+    for i in indices:
+        weight = int(columns['weight'][i])
+        ar = int(columns['ar'][i])
+        superreads.append({
+            'index': int(columns['index'][i]),
+            'vacs': column_vacs(columns, i),
+            'weight': weight,
+            'frequency': float(columns['frequency'][i]),
+            'ar': ar,
+            'ar_frequency': ar/weight,
+            'cv_start': int(columns['cv_start'][i]),
+            'cv_end': int(columns['cv_end'][i]),
+            'composition': column_composition(columns, i),
+            'discarded': bool(columns['discarded'][i])
+        })
+    return superreads
+
+
+def load_superreads(superread_path, min_cv_start=None, max_cv_end=None):
+    columns = load_superread_columns(superread_path)
+    if min_cv_start is None and max_cv_end is None:
+        return superreads_from_columns(columns)
+    min_cv_start = -np.inf if min_cv_start is None else min_cv_start
+    max_cv_end = np.inf if max_cv_end is None else max_cv_end
+    return superreads_from_columns(
+        columns, superread_window(columns, min_cv_start, max_cv_end)
+    )
+
+
+def write_superreads(superreads, superread_path):
+    if superread_path.endswith('.json'):
+        with open(superread_path, 'w') as json_file:
+            json.dump(superreads, json_file, indent=2)
+    else:
+        write_superread_store(superreads, superread_path)
+
+
+def superread_json_to_store(json_path, store_path):
+    with open(json_path) as json_file:
+        write_superread_store(json.load(json_file), store_path)
+
+
+def superread_store_to_json(store_path, json_path):
+    with open(json_path, 'w') as json_file:
+        json.dump(load_superreads(store_path), json_file, indent=2)
@@ -1,17 +1,50 @@
 import subprocess
 import json
+import logging
 import os
 import csv
+import hashlib
+import tempfile
+import time
+from multiprocessing import Pool
 
 import numpy as np
-import pandas as pd
-import pysam
-from Bio import SeqIO
-from Bio.Seq import Seq
-from Bio.SeqRecord import SeqRecord
+from numpy.lib.stride_tricks import as_strided
+
+from .pileup import read_batches, batch_aligned_pairs, expand_segments
+from .vacs import covarying_lookup, batch_covarying_bases, batch_reference_ends
+from .codec import GAP, encode_sequence, encode_records, decode_table
+from .codec import fasta_matrix
+from .distance import hamming_distances
+from .local_alignment import batch_local_alignment
+from .superread_store import load_superread_columns
+from .instrumentation import sidecar_profiles, write_profile_csv
+
+
+logger = logging.getLogger(__name__)
+
+
+# References are small and shared by many targets, so a long-lived process
+# keeps them parsed. Entries are keyed on size and mtime to notice rewrites.
+reference_cache = {}
+
+
+def load_reference(reference_path):
+    from Bio import SeqIO
+
+    reference_stat = os.stat(reference_path)
+    key = (
+        os.path.abspath(reference_path), reference_stat.st_size,
+        reference_stat.st_mtime_ns
+    )
+    if not key in reference_cache:
+        reference_cache[key] = SeqIO.read(reference_path, 'fasta')
+    return reference_cache[key]
 
 
 def get_orf(input_genome, output_genome, orf):
+    from Bio import SeqIO
+
     orf = int(orf)
     record = SeqIO.read(input_genome, 'fasta')
     record.seq = record.seq[orf:]
@@ -19,6 +52,10 @@ def get_orf(input_genome, output_genome, orf):
 
 
 def backtranslate(input_nucleotide, input_protein, output_codon):
+    from Bio import SeqIO
+    from Bio.Seq import Seq
+    from Bio.SeqRecord import SeqRecord
+
     nucleotides = SeqIO.parse(input_nucleotide, 'fasta')
     proteins = SeqIO.parse(input_protein, 'fasta')
     codons = []
@@ -44,6 +81,10 @@ def backtranslate(input_nucleotide, input_protein, output_codon):
 
 
 def select_simulated_gene(dataset, gene, output):
+    from Bio import SeqIO
+    from Bio.Seq import Seq
+    from Bio.SeqRecord import SeqRecord
+
     aligned_filename = "output/simulation/%s/aligned_%s_orf-%d_codon.fasta"
     nucleotide_genome_filename = "output/simulation/%s/genome.fasta" % dataset
     nucleotide_genome = SeqIO.read(nucleotide_genome_filename, 'fasta')
@@ -95,6 +136,10 @@ MEC improvement threshold : 0.0395 """ % (reference_filename, sam_filename))
 
 
 def parse_abayesqr_output(input_text, output_fasta):
+    from Bio import SeqIO
+    from Bio.Seq import Seq
+    from Bio.SeqRecord import SeqRecord
+
     with open(input_text) as input_file:
         lines = input_file.readlines()
     records = []
@@ -110,24 +155,18 @@ def parse_abayesqr_output(input_text, output_fasta):
     SeqIO.write(records, output_fasta, 'fasta')
 
 
-def pairwise_distance_csv(fasta_filename, csv_filename):
-    records = list(SeqIO.parse(fasta_filename, 'fasta'))
-    np_seqs = np.array(
-        [list(str(record.seq)) for record in records],
-        dtype='<U1'
-    )
-    first_records = []
-    second_records = []
-    distances = []
+def pairwise_distance_csv(fasta_filename, csv_filename, threads=1):
+    import pandas as pd
+
+    headers, np_seqs = fasta_matrix(fasta_filename)
     search_term = 'quasispecies'
-    for i in range(len(records)):
-        for j in range(len(records)):
-            if records[j].name[: len(search_term)] == search_term:
-                continue
-            first_records.append(records[i].id)
-            second_records.append(records[j].id)
-            distance = (np_seqs[i, :] != np_seqs[j, :]).sum()
-            distances.append(distance)
+    kept = [
+        j for j, header in enumerate(headers)
+        if header[: len(search_term)] != search_term
+    ]
+    first_records = np.repeat(np.array(headers, dtype=object), len(kept))
+    second_records = np.tile(np.array(headers, dtype=object)[kept], len(headers))
+    distances = hamming_distances(np_seqs, threads=int(threads))[:, kept].ravel()
     pd.DataFrame({
         'first_record': first_records,
         'second_record': second_records,
@@ -136,52 +175,77 @@ def pairwise_distance_csv(fasta_filename, csv_filename):
 
 
 def add_subtype_information(input_csv, output_csv):
+    import pandas as pd
+
     df = pd.read_csv(input_csv)
     df['Subtype1'] = df['ID1'].apply(lambda row: row.split('.')[0])
     df['Subtype2'] = df['ID2'].apply(lambda row: row.split('.')[0])
     df.to_csv(output_csv, index=False)
 
 
+def water_aligned_sequences(sequences, reference_path):
+    from Bio import SeqIO
+    from Bio.Seq import Seq
+
+    aligned_sequences = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sequence_path = os.path.join(tmp_dir, "ref.fasta")
+        alignment_path = os.path.join(tmp_dir, "aligned.fasta")
+        for sequence in sequences:
+            SeqIO.write(sequence, sequence_path, "fasta")
+            command = [
+                "water", "-asequence", sequence_path, "-bsequence",
+                reference_path, "-gapopen", "10.0", "-gapextend", ".5",
+                "-aformat", "fasta", "-outfile", alignment_path
+            ]
+            subprocess.run(command)
+            aligned_sequence = list(SeqIO.parse(alignment_path, "fasta"))[0]
+            aligned_sequence.seq = Seq(str(aligned_sequence.seq).replace('-', ''))
+            aligned_sequences.append(aligned_sequence)
+    return aligned_sequences
+
+
+def local_aligned_sequences(sequences, reference_path, processes=1):
+    from Bio.Seq import Seq
+    from Bio.SeqRecord import SeqRecord
+
+    reference = load_reference(reference_path)
+    alignments = batch_local_alignment(
+        [sequence.seq for sequence in sequences], reference.seq,
+        gap_open=10, gap_extend=.5, processes=processes
+    )
+    return [
+        SeqRecord(
+            Seq(str(sequence.seq[query_start: query_end]).replace('-', '')),
+            id=sequence.id, name=sequence.id, description=''
+        )
+        for sequence, (_, query_start, query_end) in zip(sequences, alignments)
+    ]
+
+
 def extract_truth(
         input_fasta, reference_path, dataset, reference, output_path,
-        output_json_path
+        output_json_path, processes=1
         ):
+    from Bio import SeqIO
+
     sequences = list(SeqIO.parse(input_fasta, "fasta"))
-    aligned_sequences = []
-    output_dir = os.path.join("output", "truth", dataset)
-    tmp_dir = os.path.join(
-        output_dir, "truth-%s-%s-temp" % (dataset, reference)
+    aligned_sequences = local_aligned_sequences(
+        sequences, reference_path, int(processes)
     )
-    os.mkdir(tmp_dir)
-    for sequence in sequences:
-        sequence_path = os.path.join(tmp_dir, "ref.fasta")
-        alignment_path = os.path.join(tmp_dir, "aligned.fasta")
-        SeqIO.write(sequence, sequence_path, "fasta")
-        command = [
-            "water", "-asequence", sequence_path, "-bsequence",
-            reference_path, "-gapopen", "10.0", "-gapextend", ".5", "-aformat",
-            "fasta", "-outfile", alignment_path
-        ]
-        subprocess.run(command)
-        aligned_sequence = list(SeqIO.parse(alignment_path, "fasta"))[0]
-        aligned_sequence.seq = aligned_sequence.seq.ungap('-')
-        aligned_sequences.append(aligned_sequence)
-        os.remove(sequence_path)
-        os.remove(alignment_path)
-    os.rmdir(tmp_dir)
     sequence_length = min([len(record.seq) for record in aligned_sequences])
     for record in aligned_sequences:
         record.seq = record.seq[:sequence_length]
     SeqIO.write(aligned_sequences, output_path, "fasta")
 
     pairwise_distances = []
+    _, aligned_np = encode_records(aligned_sequences)
+    disagreements = hamming_distances(aligned_np)
     for i in range(len(aligned_sequences)):
         first_sequence = aligned_sequences[i]
-        first_np = np.array(list(first_sequence.seq), dtype='<U1')
         for j in range(i+1, len(aligned_sequences)):
             second_sequence = aligned_sequences[j]
-            second_np = np.array(list(second_sequence.seq), dtype='<U1')
-            disagreement = int((first_np != second_np).sum())
+            disagreement = int(disagreements[i, j])
             pairwise_distances.append({
                 'sequenceA': first_sequence.name,
                 'sequenceB': second_sequence.name,
@@ -193,7 +257,7 @@ def extract_truth(
 def covarying_truth(
         input_computed, input_actual, input_reference, output_json
         ):
-    reference = SeqIO.read(input_reference, 'fasta')
+    reference = load_reference(input_reference)
     rl = len(reference.seq)
     with open(input_computed) as input_file:
         cvs = json.load(input_file)
@@ -229,6 +293,9 @@ def covarying_truth(
 
 
 def restrict_fasta_to_cvs(input_fasta, input_cvs, output_fasta):
+    from Bio import SeqIO
+    from Bio.Seq import Seq
+
     with open(input_cvs) as json_file:
         cvs = json.load(json_file)
     records = list(SeqIO.parse(input_fasta, 'fasta'))
@@ -237,133 +304,384 @@ def restrict_fasta_to_cvs(input_fasta, input_cvs, output_fasta):
     SeqIO.write(records, output_fasta, 'fasta')
 
 
-def downsample_bam(input_bam_path, output_bam_path, downsample_amount):
-    downsample_percentage = 1 - int(downsample_amount) / 100
-    input_bam = pysam.AlignmentFile(input_bam_path, 'rb')
-    number_of_reads = input_bam.count()
-    downsample_number = np.ceil(downsample_percentage * number_of_reads) \
-        .astype(np.int)
-    np.random.seed(1)
-    downsample_indices = np.random.choice(
-        number_of_reads, downsample_number, replace=False
-    )
-    downsample_indices.sort()
-    downsample_index = 0
-    output_bam = pysam.AlignmentFile(
-        output_bam_path, 'wb', header=input_bam.header
+def read_uniform(query_name, key):
+    digest = hashlib.blake2b(
+        query_name.encode(), digest_size=8, key=key
+    ).digest()
+    return int.from_bytes(digest, 'little') / 2**64
+
+
+def downsample_bam_levels(
+        input_bam_path, output_bam_paths, downsample_amounts, seed=1,
+        threads=1
+        ):
+    # Each read name maps to a fixed uniform value, and a read is kept at
+    # every level whose kept fraction exceeds it, so levels are nested.
+    import pysam
+
+    keep_fractions = [1 - int(amount) / 100 for amount in downsample_amounts]
+    order = sorted(
+        range(len(keep_fractions)), key=lambda i: keep_fractions[i],
+        reverse=True
     )
-    for i, read in enumerate(input_bam.fetch()):
-        if i == downsample_indices[downsample_index]:
-            output_bam.write(read)
-            downsample_index += 1
-        if downsample_index == len(downsample_indices):
-            break
-    output_bam.close()
-    pysam.index(output_bam_path)
+    key = str(seed).encode()
+    input_bam = pysam.AlignmentFile(input_bam_path, 'rb', threads=threads)
+    output_bams = [
+        pysam.AlignmentFile(
+            output_bam_paths[i], 'wb', header=input_bam.header,
+            threads=threads
+        )
+        for i in order
+    ]
+    written = [0] * len(order)
+    number_of_reads = 0
+    start = time.perf_counter()
+    for read in input_bam.fetch():
+        uniform = read_uniform(read.query_name, key)
+        for level, i in enumerate(order):
+            if uniform >= keep_fractions[i]:
+                break
+            output_bams[level].write(read)
+            written[level] += 1
+        number_of_reads += 1
+    for output_bam in output_bams:
+        output_bam.close()
     input_bam.close()
+    elapsed = time.perf_counter() - start
+    reads_per_second = number_of_reads / max(elapsed, 1e-9)
+    logger.info(
+        'Downsampled %d reads into %d levels at %.0f reads per second',
+        number_of_reads, len(order), reads_per_second
+    )
+    for output_bam_path in output_bam_paths:
+        pysam.index(output_bam_path)
+    return {
+        'reads': number_of_reads,
+        'seconds': elapsed,
+        'reads_per_second': reads_per_second,
+        'written': {
+            output_bam_paths[i]: written[level]
+            for level, i in enumerate(order)
+        }
+    }
+
+
+def downsample_bam(
+        input_bam_path, output_bam_path, downsample_amount, seed=1, threads=1
+        ):
+    return downsample_bam_levels(
+        input_bam_path, [output_bam_path], [downsample_amount], seed, threads
+    )
 
 
 def pluck_record(input_fasta_path, output_fasta_path, record):
+    from Bio import SeqIO
+
     all_records = SeqIO.parse(input_fasta_path, 'fasta')
     desired_record = SeqIO.to_dict(all_records)[record]
     SeqIO.write(desired_record, output_fasta_path, 'fasta')
 
 
-def single_mapping_dataset(bam_path, ref_path, output_path):
-    bam = pysam.AlignmentFile(bam_path)
-    ref = SeqIO.read(ref_path, 'fasta')
-    percent_identity = np.zeros(bam.mapped, dtype=np.float)
-    differences = np.zeros(bam.mapped, dtype=np.float)
-    number_of_aligned_pairs = np.zeros(bam.mapped, dtype=np.float)
-    for i, read in enumerate(bam.fetch()):
-        aligned_pairs = read.get_aligned_pairs(matches_only=True)
-        aligned_query = np.array([
-            read.query[pair[0]] for pair in aligned_pairs
-        ], dtype='<U1')
-        aligned_reference = np.array([
-            ref[pair[1]] for pair in aligned_pairs
-        ], dtype='<U1')
-        agreement = (aligned_query == aligned_reference).sum()
-        number_of_aligned_pairs[i] = len(aligned_pairs)
-        differences[i] = number_of_aligned_pairs[i] - agreement
-        percent_identity[i] = agreement/number_of_aligned_pairs[i]
-
-    quality = np.array([
-        read.mapping_quality for read in bam.fetch()
-    ], dtype=np.int)
-    query_length = np.array([
-        read.query_length for read in bam.fetch()
-    ], dtype=np.int)
-    result = pd.DataFrame({
-        'mapping_quality': quality,
+def mapping_chunk_statistics(reads, reference, use_tags=False):
+    import pandas as pd
+
+    number_of_reads = len(reads)
+    aligned = np.array([
+        bool(read.cigartuples) and read.query_sequence is not None
+        for read in reads
+    ], dtype=bool)
+    number_of_aligned_pairs = np.zeros(number_of_reads, dtype=np.float64)
+    agreement = np.zeros(number_of_reads, dtype=np.float64)
+    tagged = np.zeros(number_of_reads, dtype=bool)
+    if use_tags:
+        # NM already holds mismatches plus indel lengths, so tagged reads
+        # only need their CIGAR.
+        for i, read in enumerate(reads):
+            if aligned[i] and read.has_tag('NM'):
+                tagged[i] = True
+                matched = 0
+                indels = 0
+                for operation, length in read.cigartuples:
+                    if operation in (0, 7, 8):
+                        matched += length
+                    elif operation in (1, 2):
+                        indels += length
+                number_of_aligned_pairs[i] = matched
+                agreement[i] = matched - (read.get_tag('NM') - indels)
+    compared_rows = np.flatnonzero(aligned & ~tagged)
+    compared_reads = [reads[i] for i in compared_rows]
+    batch = next(
+        read_batches(compared_reads, batch_size=max(len(compared_reads), 1)),
+        None
+    )
+    if batch is not None:
+        read_index, reference_positions, query_indices = batch_aligned_pairs(batch)
+        rows = compared_rows[read_index]
+        on_reference = reference_positions < len(reference)
+        matches = np.zeros(len(read_index), dtype=bool)
+        matches[on_reference] = batch['sequence'][query_indices[on_reference]] \
+            == reference[reference_positions[on_reference]]
+        number_of_aligned_pairs += np.bincount(rows, minlength=number_of_reads)
+        agreement += np.bincount(rows, weights=matches, minlength=number_of_reads)
+    differences = number_of_aligned_pairs - agreement
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percent_identity = agreement / number_of_aligned_pairs
+    return pd.DataFrame({
+        'mapping_quality': np.array(
+            [read.mapping_quality for read in reads], dtype=np.int64
+        ),
         'differences': differences,
         'number_of_aligned_pairs': number_of_aligned_pairs,
         'percent_identity': percent_identity,
-        'query_length': query_length
-    }, index=[read.query_name for read in bam.fetch()])
-    result.to_csv(output_path, index_label='read_id')
+        'query_length': np.array(
+            [read.query_length for read in reads], dtype=np.int64
+        )
+    }, index=[read.query_name for read in reads])
+
+
+def mapping_statistics(bam_path, ref_path, batch_size=20000, use_tags=False):
+    import pysam
+
+    bam = pysam.AlignmentFile(bam_path)
+    reference = np.frombuffer(
+        str(load_reference(ref_path).seq).encode('ascii'), dtype=np.uint8
+    )
+    reads = []
+    for read in bam.fetch():
+        reads.append(read)
+        if len(reads) == batch_size:
+            yield mapping_chunk_statistics(reads, reference, use_tags)
+            reads = []
+    if len(reads) > 0:
+        yield mapping_chunk_statistics(reads, reference, use_tags)
+    bam.close()
+
+
+def single_mapping_dataset(
+        bam_path, ref_path, output_path, batch_size=20000, use_tags=False
+        ):
+    header = True
+    with open(output_path, 'w') as output_file:
+        for chunk in mapping_statistics(
+                bam_path, ref_path, batch_size, use_tags
+                ):
+            chunk.to_csv(output_file, index_label='read_id', header=header)
+            header = False
+    if header:
+        mapping_chunk_statistics([], np.zeros(0, dtype=np.uint8)) \
+            .to_csv(output_path, index_label='read_id')
+
+
+def mapping_dataset(arguments):
+    import pandas as pd
+
+    bam_path, ref_path, batch_size, use_tags = arguments
+    chunks = list(mapping_statistics(bam_path, ref_path, batch_size, use_tags))
+    if len(chunks) == 0:
+        return mapping_chunk_statistics([], np.zeros(0, dtype=np.uint8))
+    return pd.concat(chunks, axis=0)
+
+
+def combine_mapping_datasets(all_datasets, dataset_names):
+    import pandas as pd
+
+    for dataset_name, dataset in zip(dataset_names, all_datasets):
+        dataset['reference'] = dataset_name
+    return pd.concat(all_datasets, axis=0, sort=False, ignore_index=True)
 
 
 def full_fvm_mapping_dataset(dataset_paths, output_csv_path):
+    import pandas as pd
+
     all_datasets = list(map(
         lambda path: pd.read_csv(path, index_col='read_id'),
         dataset_paths
     ))
-    for dataset_path, dataset in zip(dataset_paths, all_datasets):
-        dataset_name = dataset_path.split('/')[-2]
-        dataset['reference'] = dataset_name
-    pd.concat(all_datasets, axis=0, sort=False, ignore_index=True) \
+    dataset_names = [
+        dataset_path.split('/')[-2] for dataset_path in dataset_paths
+    ]
+    combine_mapping_datasets(all_datasets, dataset_names) \
         .to_csv(output_csv_path)
 
 
-def true_covarying_kmers(input_fasta, input_json, output_csv, k):
-    k = int(k)
-    records = np.array([
-        list(record.seq)
-        for record in SeqIO.parse(input_fasta, 'fasta')
-    ], dtype='<U1')
-    data = {
-        **{'index_%d' % i: [] for i in range(k)},
-        **{'character_%d' % i: [] for i in range(k)}
-    }
+def batch_fvm_mapping_dataset(
+        bam_paths, ref_paths, dataset_names, output_csv_path, processes=1,
+        batch_size=20000, use_tags=False
+        ):
+    arguments = [
+        (bam_path, ref_path, batch_size, use_tags)
+        for bam_path, ref_path in zip(bam_paths, ref_paths)
+    ]
+    if processes > 1:
+        with Pool(processes) as pool:
+            all_datasets = pool.map(mapping_dataset, arguments)
+    else:
+        all_datasets = list(map(mapping_dataset, arguments))
+    combine_mapping_datasets(all_datasets, dataset_names) \
+        .to_csv(output_csv_path)
+
+
+def window_kmers(site_codes, k, first_window, last_window):
+    number_of_sequences = site_codes.shape[0]
+    windows = as_strided(
+        site_codes,
+        shape=(number_of_sequences, site_codes.shape[1] - k + 1, k),
+        strides=(site_codes.strides[0], site_codes.strides[1], site_codes.strides[1])
+    )
+    number_of_windows = last_window - first_window
+    # Keys are the big-endian window id followed by the k-mer codes, so
+    # sorting them bytewise groups k-mers by window. Keys that fit in eight
+    # bytes are sorted as integers.
+    width = 8 if k <= 4 else 4 + k
+    key_type = '>u8' if k <= 4 else 'V%d' % width
+    keys = np.zeros((number_of_windows, number_of_sequences, width), dtype=np.uint8)
+    keys[:, :, :4] = np.arange(first_window, last_window, dtype='>u4') \
+        .view(np.uint8).reshape(-1, 1, 4)
+    keys[:, :, 4: 4 + k] = windows[:, first_window: last_window].transpose(1, 0, 2)
+    unique_keys = np.unique(keys.reshape(-1, width).view(key_type).ravel())
+    unique_keys = unique_keys.view(np.uint8).reshape(-1, width)
+    window = unique_keys[:, :4].copy().view('>u4').ravel().astype(np.int64)
+    return window, unique_keys[:, 4: 4 + k]
+
+
+def covarying_kmer_table(
+        site_codes, covarying_sites, k, number_of_windows=None,
+        chunk_size=2**22
+        ):
+    import pandas as pd
+
+    if number_of_windows is None:
+        number_of_windows = len(covarying_sites) - k + 1
+    number_of_windows = max(number_of_windows, 0)
+    windows_per_chunk = max(chunk_size // max(site_codes.shape[0], 1), 1)
+    all_windows = []
+    all_kmers = []
+    for first_window in range(0, number_of_windows, windows_per_chunk):
+        last_window = min(first_window + windows_per_chunk, number_of_windows)
+        window, kmers = window_kmers(site_codes, k, first_window, last_window)
+        all_windows.append(window)
+        all_kmers.append(kmers)
+    window = np.concatenate(all_windows) if all_windows else np.zeros(0, dtype=np.int64)
+    kmers = np.vstack(all_kmers) if all_kmers else np.zeros((0, k), dtype=np.uint8)
+    return pd.DataFrame({
+        **{
+            'index_%d' % i: covarying_sites[window + i] for i in range(k)
+        },
+        **{
+            'character_%d' % i: decode_table[kmers[:, i]].view('S1').astype('U1')
+            for i in range(k)
+        }
+    })
+
+
+def true_covarying_kmer_range(input_fasta, input_json, output_csvs, ks):
+    _, records = fasta_matrix(input_fasta)
     with open(input_json) as json_file:
         covarying_sites = np.array(json.load(json_file), dtype=np.int)
-    for i in range(len(covarying_sites) - k):
-        covarying_indices = covarying_sites[i:i+k]
-        covarying_kmers = set()
-        for row_index in range(records.shape[0]):
-            covarying_kmer = ''.join(records[row_index, covarying_indices])
-            covarying_kmers.add(covarying_kmer)
-        for covarying_kmer in list(covarying_kmers):
-            for i in range(k):
-                data['index_%d' % i].append(covarying_indices[i])
-                data['character_%d' % i].append(covarying_kmer[i])
-    pd.DataFrame(data).to_csv(output_csv, index=False)
-
-
-def kmers_in_reads(input_bam, input_csv, output_csv, k):
+    site_codes = np.ascontiguousarray(records[:, covarying_sites])
+    for output_csv, k in zip(output_csvs, ks):
+        k = int(k)
+        # Windows start before the last k covarying sites, as they always have.
+        covarying_kmer_table(
+            site_codes, covarying_sites, k, len(covarying_sites) - k
+        ).to_csv(output_csv, index=False)
+
+
+def true_covarying_kmers(input_fasta, input_json, output_csv, k):
+    true_covarying_kmer_range(input_fasta, input_json, [output_csv], [k])
+
+
+def kmer_table(df, k):
+    index_columns = ['index_%d' % i for i in range(k)]
+    character_columns = ['character_%d' % i for i in range(k)]
+    windows, window_ids = np.unique(
+        df[index_columns].values.astype(np.int64), axis=0, return_inverse=True
+    )
+    positions = np.unique(windows)
+    kmers = {}
+    kmer_ids = np.zeros(len(df), dtype=np.int64)
+    for row, (window_id, characters) in enumerate(zip(
+            window_ids.tolist(), df[character_columns].values.tolist()
+            )):
+        key = (window_id, ''.join(characters).encode('ascii'))
+        kmer_ids[row] = kmers.setdefault(key, len(kmers))
+    return {
+        'k': k,
+        'positions': positions,
+        'window_starts': windows[:, 0],
+        'window_ends': windows[:, -1],
+        'window_columns': np.searchsorted(positions, windows),
+        'kmers': kmers,
+        'kmer_ids': kmer_ids
+    }
+
+
+def batch_kmer_support(batch, table, lookup):
+    number_of_positions = len(table['positions'])
+    read_index, covarying_index, bases = batch_covarying_bases(batch, lookup)
+    keys = read_index * number_of_positions + covarying_index
+    read_starts = batch['reference_starts']
+    read_ends = batch_reference_ends(batch)
+    first = np.searchsorted(table['window_starts'], read_starts, 'left')
+    last = np.searchsorted(table['window_starts'], read_ends, 'right')
+    pair_read, pair_window = expand_segments(first, np.maximum(last - first, 0))
+    inside = table['window_ends'][pair_window] <= read_ends[pair_read]
+    pair_read = pair_read[inside]
+    pair_window = pair_window[inside]
+    wanted = pair_read[:, np.newaxis] * number_of_positions \
+        + table['window_columns'][pair_window]
+    if len(keys) == 0:
+        return []
+    found = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+    complete = (keys[found] == wanted).all(axis=1)
+    vacs = np.ascontiguousarray(bases[found[complete]]) \
+        .view('S%d' % table['k']).ravel()
+    kmers = table['kmers']
+    return [
+        kmers[key] for key in zip(pair_window[complete].tolist(), vacs.tolist())
+        if key in kmers
+    ]
+
+
+def kmer_support(arguments):
+    import pysam
+
+    bam_path, table, batch_size = arguments
+    bam = pysam.AlignmentFile(bam_path)
+    lookup = covarying_lookup(table['positions'], bam.lengths[0])
+    support = np.zeros(len(table['kmers']), dtype=np.int64)
+    for batch in read_batches(bam.fetch(), batch_size):
+        support += np.bincount(
+            batch_kmer_support(batch, table, lookup),
+            minlength=len(table['kmers'])
+        )
+    bam.close()
+    return support
+
+
+def kmers_in_reads(
+        input_bam, input_csv, output_csv, k, processes=1, batch_size=20000
+        ):
+    import pandas as pd
+
     k = int(k)
-    bam = pysam.AlignmentFile(input_bam)
+    bam_paths = [input_bam] if isinstance(input_bam, str) else list(input_bam)
     df = pd.read_csv(input_csv)
-    df['support'] = np.zeros(len(df), dtype=np.int)
-    for read in bam.fetch():
-        starts_after = df.index_0 >= read.reference_start
-        ends_before = df['index_%d' % (k-1)] <= read.reference_end
-        relevent_kmers = df.loc[starts_after & ends_before, :]
-        for i, row in relevent_kmers.iterrows():
-            inds = list(row[['index_%d' % i for i in range(k)]])
-            vacs = ''.join([
-                read.query[pair[0]]
-                for pair in read.get_aligned_pairs(matches_only=True)
-                if pair[1] in inds
-            ])
-            kmer = ''.join(row[['character_%d' % i for i in range(k)]])
-            if vacs == kmer:
-                df.loc[i, 'support'] += 1
+    table = kmer_table(df, k)
+    arguments = [(bam_path, table, batch_size) for bam_path in bam_paths]
+    if processes > 1:
+        with Pool(processes) as pool:
+            all_support = pool.map(kmer_support, arguments)
+    else:
+        all_support = list(map(kmer_support, arguments))
+    support = np.sum(all_support, axis=0)
+    df['support'] = support[table['kmer_ids']]
     df.to_csv(output_csv)
 
 
 def result_json(distance_csv, output_json):
+    import pandas as pd
+
     df = pd.read_csv(distance_csv)
     not_quasispecies = df.first_record.apply(lambda x: x[:3] != 'qua')
     desired_records = list(set(df.first_record[not_quasispecies]))
@@ -384,6 +702,9 @@ def result_json(distance_csv, output_json):
 
 
 def covarying_fasta(input_json, input_fasta, output_fasta, end_correction=10):
+    from Bio import SeqIO
+    from Bio.Seq import Seq
+
     with open(input_json) as json_file:
         covarying_sites = json.load(json_file)
     records = list(SeqIO.parse(input_fasta, 'fasta'))
@@ -399,7 +720,16 @@ def covarying_fasta(input_json, input_fasta, output_fasta, end_correction=10):
     SeqIO.write(records, output_fasta, 'fasta')
 
 
-def report(input_files, output_csv, report_type):
+def report(input_files, output_csv, report_type, profile_csv=None):
+    if profile_csv is not None:
+        write_profile_csv(
+            sidecar_profiles(input_files), profile_csv,
+            lambda path: {
+                'dataset': path.split('/')[1],
+                'gene': path.split('/')[4],
+                'report_type': report_type
+            }
+        )
     csvfile = open(output_csv, 'w')
     field_names = ['dataset', 'gene', 'worst_distance', 'report_type']
     writer = csv.DictWriter(csvfile, field_names)
@@ -445,11 +775,65 @@ def haplotyper_report(input_files, output_csv):
     csvfile.close()
 
 
-def superread_agreement(input_superreads, input_fasta, input_json, output_csv):
-    superreads = list(SeqIO.parse(input_superreads, 'fasta'))
-    truth = list(SeqIO.parse(input_fasta, 'fasta'))
+def superread_agreement_row(name, sequence, truth_names, truth_np, sites):
+    superread_id, weight = name.split('_')
+    weight = int(weight.split('-')[1])
+    superread_np = encode_sequence(sequence)[sites]
+    start = (superread_np != GAP).argmax()
+    stop = ((np.arange(len(sites)) >= start) & (superread_np == GAP)).argmax()
+    mismatches = truth_np[:, start:stop] != superread_np[start:stop]
+    diffs = mismatches.sum(axis=1)
+    smallest = diffs.argmin()
+    smallest_recomb = 1e6
+    if stop > start:
+        # Mismatches of truth a before breakpoint i plus those of truth b
+        # from i on; the best a and b can be picked independently per i.
+        prefix = np.zeros((len(truth_np), stop - start + 1), dtype=np.int64)
+        np.cumsum(mismatches, axis=1, out=prefix[:, 1:])
+        before = prefix[:, :-1].min(axis=0)
+        after = (prefix[:, -1:] - prefix[:, :-1]).min(axis=0)
+        smallest_recomb = (before + after).min()
+    return {
+        'superread_id': superread_id,
+        'weight': weight,
+        'true_id': truth_names[smallest],
+        'smallest_diff': diffs[smallest],
+        'smallest_recomb': smallest_recomb,
+        'start': start,
+        'stop': stop
+    }
+
+
+def superread_agreement_rows(arguments):
+    superreads, truth_names, truth_np, sites = arguments
+    return [
+        superread_agreement_row(name, sequence, truth_names, truth_np, sites)
+        for name, sequence in superreads
+    ]
+
+
+def superread_agreement(
+        input_superreads, input_fasta, input_json, output_csv, processes=1,
+        chunk_size=1000
+        ):
+    from Bio import SeqIO
+
+    superreads = [
+        (superread.name, str(superread.seq))
+        for superread in SeqIO.parse(input_superreads, 'fasta')
+    ]
+    truth_names, truth_np = fasta_matrix(input_fasta)
     with open(input_json) as json_file:
         sites = np.array(json.load(json_file), dtype=np.int)
+    arguments = [
+        (superreads[i: i+chunk_size], truth_names, truth_np, sites)
+        for i in range(0, len(superreads), chunk_size)
+    ]
+    if processes > 1:
+        with Pool(processes) as pool:
+            chunks = pool.map(superread_agreement_rows, arguments)
+    else:
+        chunks = list(map(superread_agreement_rows, arguments))
     csvfile = open(output_csv, 'w')
     csvwriter = csv.DictWriter(
         csvfile, fieldnames=[
@@ -463,45 +847,16 @@ def superread_agreement(input_superreads, input_fasta, input_json, output_csv):
         ]
     )
     csvwriter.writeheader()
-    n_char = len(sites)
-    for superread in superreads:
-        smallest_diff = 1e6
-        superread_id, weight = superread.name.split('_')
-        weight = int(weight.split('-')[1])
-        superread_np = np.array(list(superread.seq), dtype='<U1')[sites]
-        start = (superread_np != '-').argmax()
-        stop = ((np.arange(n_char) >= start) & (superread_np == '-')).argmax()
-        smallest_recomb = 1e6
-        for true_sequence_a in truth:
-            true_a_np = np.array(list(true_sequence_a.seq), dtype='<U1')
-            diff = (superread_np[start:stop] != true_a_np[start:stop]).sum()
-            if diff < smallest_diff:
-                smallest_diff = diff
-                smallest_id = true_sequence_a.name
-            for true_sequence_b in truth:
-                true_b_np = np.array(list(true_sequence_b.seq), dtype='<U1')
-                for i in range(start, stop):
-                    first = true_a_np[start:i] != superread_np[start:i]
-                    second = true_b_np[i:stop] != superread_np[i:stop]
-                    recomb = first.sum() + second.sum()
-                    if recomb < smallest_recomb:
-                        smallest_recomb = recomb
-        csvwriter.writerow({
-            'superread_id': superread_id,
-            'weight': weight,
-            'true_id': smallest_id,
-            'smallest_diff': smallest_diff,
-            'smallest_recomb': smallest_recomb,
-            'start': start,
-            'stop': stop
-        })
+    for rows in chunks:
+        csvwriter.writerows(rows)
     csvfile.close()
 
 
 def superread_scatter_data(superread_path, output_csv):
-    with open(superread_path) as json_file:
-        superreads = json.load(json_file)
+    import pandas as pd
+
+    superreads = load_superread_columns(superread_path)
     pd.DataFrame({
-        'weight': [sr['weight'] for sr in superreads],
-        'vacs_length': [len(sr['vacs']) for sr in superreads],
+        'weight': np.asarray(superreads['weight']),
+        'vacs_length': np.asarray(superreads['vacs_length']),
     }).to_csv(output_csv)
@@ -0,0 +1,55 @@
+import numpy as np
+
+from .pileup import consumes_reference
+from .pileup import batch_aligned_pairs
+
+
+upper_case = np.arange(256, dtype=np.uint8)
+upper_case[ord('a'): ord('z') + 1] -= ord('a') - ord('A')
+
+
+def covarying_lookup(covarying_sites, reference_length=0):
+    covarying_sites = np.asarray(covarying_sites, dtype=np.int64)
+    if len(covarying_sites) > 0:
+        reference_length = max(reference_length, covarying_sites.max() + 1)
+    lookup = np.full(reference_length, -1, dtype=np.int64)
+    lookup[covarying_sites] = np.arange(len(covarying_sites))
+    return lookup
+
+
+def batch_reference_ends(batch):
+    read_index = np.repeat(
+        np.arange(len(batch['operation_counts'])), batch['operation_counts']
+    )
+    reference_lengths = np.bincount(
+        read_index,
+        weights=batch['lengths'] * consumes_reference[batch['operations']],
+        minlength=len(batch['operation_counts'])
+    ).astype(np.int64)
+    return batch['reference_starts'] + reference_lengths
+
+
+def batch_covarying_bases(batch, lookup):
+    read_index, reference_positions, query_indices = batch_aligned_pairs(batch)
+    in_lookup = reference_positions < len(lookup)
+    covarying_index = np.full(len(reference_positions), -1, dtype=np.int64)
+    covarying_index[in_lookup] = lookup[reference_positions[in_lookup]]
+    at_site = covarying_index >= 0
+    bases = upper_case[batch['sequence'][query_indices[at_site]]]
+    return read_index[at_site], covarying_index[at_site], bases
+
+
+def read_offsets(read_index, number_of_reads):
+    counts = np.bincount(read_index, minlength=number_of_reads)
+    return np.concatenate([[0], np.cumsum(counts)])
+
+
+def batch_vacs(batch, lookup):
+    read_index, _, bases = batch_covarying_bases(batch, lookup)
+    offsets = read_offsets(read_index, len(batch['reference_starts']))
+    characters = bases.tobytes().decode('ascii')
+    return [
+        characters[offsets[i]: offsets[i+1]]
+        for i in range(len(offsets) - 1)
+    ]
+